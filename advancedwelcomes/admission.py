@@ -0,0 +1,56 @@
+# decides how much of a welcome image to render from how far behind the render pool is
+
+from typing import NamedTuple
+from .encoding import OutputEncoding
+
+DEFAULT_RENDER_SLO = 5
+
+# levels a welcome steps down through, each one is also the name of its counter in [p]cw stats
+FULL = "full"
+REDUCED = "reduced_res"
+CHEAP = "cheap_encode"
+TEXT = "text_only"
+
+# the expected queue wait, as a share of the guild's slo, that each level is used up to
+STEPS = ((0.5, FULL), (0.75, REDUCED), (1.0, CHEAP))
+
+REDUCED_SCALE = 0.5
+CHEAP_ENCODING = OutputEncoding("jpeg", 70)
+
+
+class RenderPlan(NamedTuple):
+    """
+    how one welcome gets rendered. scale shrinks the finished image before it's encoded
+    """
+
+    level: str
+    scale: float = 1.0
+    encoding: OutputEncoding = OutputEncoding()
+
+    @property
+    def degraded(self):
+        return self.level != FULL
+
+
+def plan_render(estimated_wait, slo, encoding):
+    """
+    returns the RenderPlan for a welcome that would wait estimated_wait seconds for a worker.
+    the plan steps down before the wait reaches the slo, and to text only once it would pass it.
+    an slo of 0 always renders in full
+    """
+    if slo <= 0:
+        return RenderPlan(FULL, 1.0, encoding)
+
+    level = TEXT
+    for share, step in STEPS:
+        if estimated_wait <= slo * share:
+            level = step
+            break
+
+    if level == FULL:
+        return RenderPlan(FULL, 1.0, encoding)
+    if level == REDUCED:
+        return RenderPlan(REDUCED, REDUCED_SCALE, encoding)
+    if level == CHEAP:
+        return RenderPlan(CHEAP, REDUCED_SCALE, CHEAP_ENCODING)
+    return RenderPlan(TEXT)
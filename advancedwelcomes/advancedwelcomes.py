@@ -3,18 +3,83 @@ from redbot.core.bot import Red
 import discord
 import os
 import sys
+import time
 import asyncio
 import aiohttp
-import pathlib
 import io
 import random
-from PIL import Image, ImageChops, ImageOps
+import logging
+from .assets import AssetRegistry
+from .templatecache import TemplateCache, DEFAULT_BUDGET_MB
+from .renderer import RenderExecutor, DEFAULT_WORKERS, DEFAULT_QUEUE
+from .compositing import (
+    tile_avatars,
+    avatar_radius,
+    montage_layout,
+    MAX_MONTAGE_TILES,
+    TEMPLATE_SIZE,
+    scale_image,
+)
+from .burst import JoinBurstTracker
+from .avatars import AvatarFetcher, DEFAULT_AVATAR_CACHE_MB, MAX_CONCURRENT_DOWNLOADS
+from .settings import GuildSettingsCache
+from .manifest import TemplatePool
+from .sendqueue import ChannelSendQueue, SendLimits, POLICIES
+from .metrics import WelcomeMetrics, NULL_TRACE
+from .animated import render_animated, AnimationTooExpensive
+from .uploads import TemplateUploader, InvalidUpload, write_template
+from .rawstore import RawTemplateStore
+from .warmup import WarmupProgress, WARM_BUDGET_SHARE
+from .contactsheet import (
+    ContactSheetCache,
+    render_contact_sheet,
+    page_count,
+    PAGE_SIZE,
+)
+from .importer import import_archive, MAX_ARCHIVE_BYTES
+from .blobstore import BlobStore, BLOB
+from .outputcache import (
+    OutputCache,
+    output_key,
+    DEFAULT_OUTPUT_CACHE_MB,
+    DEFAULT_OUTPUT_DISK_MB,
+)
+from .loadtest import (
+    SimulatedGuild,
+    run_raid,
+    format_report,
+    MAX_RAID_JOINS,
+)
+from .admission import plan_render, RenderPlan, FULL, TEXT, DEFAULT_RENDER_SLO
+from .messages import (
+    compile_message,
+    welcome_values,
+    clamp_message,
+    render_welcome,
+    MENTIONS_ONLY,
+    placeholder_help,
+    InvalidPlaceholder,
+)
+
+from .encoding import (
+    OutputEncoding,
+    encode_image,
+    FORMATS,
+    DEFAULT_QUALITY,
+    QUALITY_RANGE,
+)
+
+# none of the modules above import PIL until an image is first decoded or drawn,
+# so a bot with welcome images off never loads it
+
+log = logging.getLogger("red.advancedwelcomes")
 
 
 class AdvancedWelcomes(commands.Cog):
     """Fully customizable welcome cog, with support for images"""
 
-    def __init__(self, bot):
+    def __init__(self, bot, import_seconds=0.0):
+        started = time.perf_counter()
         self.bot = bot
         self.config = Config.get_conf(self, 169234992, force_registration=True)
 
@@ -28,74 +93,439 @@ class AdvancedWelcomes(commands.Cog):
             "mandatory_msg_frag": "default mandatory message snippet",
             "message_pool": [],
             "img_avatar_cfgs": {},
+            "img_blobs": {},
+            "burst_window": 0,
+            "burst_threshold": 5,
+            "output_format": "png",
+            "output_quality": DEFAULT_QUALITY["png"],
+            "output_max_kb": 0,
+            "send_queue_depth": 20,
+            "send_queue_policy": "collapse",
+            "send_latency_budget": 30,
+            "animated_avatars": False,
+            "render_slo": DEFAULT_RENDER_SLO,
+        }
+
+        default_global = {
+            "template_cache_mb": DEFAULT_BUDGET_MB,
+            "render_workers": DEFAULT_WORKERS,
+            "render_queue": DEFAULT_QUEUE,
+            "avatar_cache_mb": DEFAULT_AVATAR_CACHE_MB,
+            "output_cache_mb": DEFAULT_OUTPUT_CACHE_MB,
+            "output_disk_mb": DEFAULT_OUTPUT_DISK_MB,
+            "log_joins": False,
         }
 
         self.config.register_guild(**default_guild)
+        self.config.register_global(**default_global)
+        # joins read this snapshot instead of making a config call per setting
+        self.settings = GuildSettingsCache(self.config)
+        # each guild's random pool, so joins pick a template without a config or disk read
+        self.pools = TemplatePool()
+
+        # static overlays are generated per radius on first use and shared by every render
+        self.assets = AssetRegistry()
+        # PIL work runs here so joins never block the event loop
+        self.renderer = RenderExecutor()
+        # joins arriving in a burst are welcomed together
+        self.bursts = JoinBurstTracker(self.send_burst_welcome)
+        # welcomes leave through a paced, ordered queue per channel
+        self.outbound = ChannelSendQueue()
+        # contact sheets of each guild's pool, drawn again only when the pool changes
+        self.previews = ContactSheetCache()
+        # per-stage timings and counters behind [p]cw stats
+        self.metrics = WelcomeMetrics()
+        # templates are loaded in the background after a restart so the first joins don't pay for it
+        self.warmup = WarmupProgress()
+        self.warmup_task = None
+        # only one simulated raid runs at a time
+        self.raid_running = False
+
+        # the http session and everything kept on disk are set up in cog_load
+        self.session = None
+        # seconds spent importing, constructing and setting up the cog, shown by [p]cw cfg cachestats
+        self.load_timings = {"import": import_seconds}
+        self.load_timings["init"] = time.perf_counter() - started
+
+    def open_storage(self):
+        """
+        creates the cog's data directories and the stores kept in them. blocking
+        """
         self.data_dir = data_manager.cog_data_path(cog_instance=self)
+        # where templates were stored per guild before the blob store, only read to migrate them
         self.img_dir = self.data_dir / "welcome_imgs"
+        # raw RGBA copies of the templates, mapped instead of decoded on a cache miss
+        self.raw_templates = RawTemplateStore(self.data_dir / "raw_templates")
+        # decoded templates, evicted lru-first once over the memory budget
+        self.templates = TemplateCache(raw_store=self.raw_templates)
+        # pool templates stored once by content hash, however many guilds use them
+        self.blobs = BlobStore(self.data_dir / "template_blobs", self.raw_templates)
+        # finished images, so a member rejoining or a preview doesn't render again
+        self.outputs = OutputCache(self.data_dir / "rendered")
+
+    async def cog_load(self):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.open_storage)
 
-        self.session = aiohttp.ClientSession()
-        # a header to successfully download user avatars for use
-        self.headers = {"User-agent": "Mozilla/5.0"}
-
-        # create folder to hold welcome images
         try:
-            os.mkdir(self.img_dir)
-        except OSError as error:
-            pass
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_DOWNLOADS)
+            )
+            # avatars come from the cdn at render size and stay decoded between joins
+            self.avatars = AvatarFetcher(self.session, self.renderer)
+            self.uploads = TemplateUploader(self.session, self.renderer)
+
+            self.templates.set_budget(await self.config.template_cache_mb())
+            self.avatars.cache.set_budget(await self.config.avatar_cache_mb())
+            self.outputs.set_budget(
+                await self.config.output_cache_mb(), await self.config.output_disk_mb()
+            )
+            await loop.run_in_executor(None, self.outputs.load_index)
+            self.metrics.log_joins = await self.config.log_joins()
+            self.renderer.resize(
+                await self.config.render_workers(), await self.config.render_queue()
+            )
+            await self.load_blobs()
+            self.warmup_task = asyncio.create_task(self.warm_caches())
+        except BaseException:
+            # a cog that fails to load is never unloaded, so close what was opened here
+            await self.cog_unload()
+            raise
+
+        self.load_timings["setup"] = time.perf_counter() - started
+        log.info("Loaded in %s", self.load_summary())
+
+    async def cog_unload(self):
+        started = time.perf_counter()
+        if self.warmup_task is not None:
+            self.warmup_task.cancel()
+        self.bursts.cancel_all()
+        self.outbound.close()
+        self.renderer.shutdown()
+        if self.session is not None:
+            await self.session.close()
+        log.info("Unloaded in %.0f ms", (time.perf_counter() - started) * 1000)
+
+    def load_summary(self):
+        return ", ".join(
+            f"{stage} {seconds * 1000:.0f} ms"
+            for stage, seconds in self.load_timings.items()
+        )
+
+    async def load_blobs(self):
+        """
+        moves pool templates still stored per guild into the blob store, then counts every guild's references
+        and deletes blobs nothing refers to
+        """
+        loop = asyncio.get_running_loop()
+        all_guilds = await self.config.all_guilds()
+        mappings = []
+        for guild_id, data in all_guilds.items():
+            img_blobs = dict(data.get("img_blobs", {}))
+            legacy = [
+                name
+                for name in data.get("img_avatar_cfgs", {})
+                if name != "default.png" and name not in img_blobs
+            ]
+            for name in legacy:
+                path = self.img_dir / str(guild_id) / name
+                try:
+                    digest = await loop.run_in_executor(None, self.blobs.migrate, path)
+                except FileNotFoundError:
+                    continue
+                except Exception:
+                    # left where it is, so one unreadable file neither stops the load nor gets lost
+                    log.warning("Couldn't migrate template %s", path, exc_info=True)
+                    continue
+
+                # the hash is saved before the old file goes, so an interrupted load can't lose the template
+                img_blobs[name] = digest
+                await self.config.guild_from_id(guild_id).img_blobs.set(img_blobs)
+                await loop.run_in_executor(None, self.blobs.retire, path)
+            mappings.append(img_blobs)
+
+        self.blobs.rebuild(mappings)
+        removed = await loop.run_in_executor(None, self.blobs.sweep)
+        if removed:
+            log.info("Removed %s unreferenced template blobs", removed)
+
+    async def warm_caches(self):
+        """
+        loads the settings, image pools and compiled templates of every guild with welcome images on,
+        one template at a time and until the template cache is mostly full
+        """
+        await self.bot.wait_until_red_ready()
+        all_guilds = await self.config.all_guilds()
+        guild_ids = [
+            guild_id
+            for guild_id, data in all_guilds.items()
+            if data.get("toggle_img") or data.get("randomise_img")
+        ]
+        self.warmup.start(len(guild_ids))
+
+        for guild_id in guild_ids:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                self.warmup.guilds_done += 1
+                continue
+
+            settings = await self.settings.get(guild)
+            templates = []
+            if settings.toggle_img:
+                coords = settings.img_avatar_cfgs.get("default.png")
+                if coords is not None:
+                    templates.append(
+                        (guild_id, "default.png", self.data_dir / "default.png", coords)
+                    )
+            if settings.randomise_img:
+                pool = await self.get_pool(guild)
+                for name, coords in list(pool.coords.items()):
+                    digest = pool.digests[name]
+                    templates.append((BLOB, digest, self.blobs.path(digest), coords))
+
+            for owner, name, path, coords in templates:
+                stats = self.templates.stats()
+                if stats["used_bytes"] >= stats["budget_bytes"] * WARM_BUDGET_SHARE:
+                    self.warmup.finish("template cache budget reached")
+                    log.info(self.warmup.summary())
+                    return
+                try:
+                    await self.renderer.run(
+                        self.templates.compiled,
+                        owner,
+                        name,
+                        path,
+                        coords,
+                        self.assets,
+                    )
+                    self.warmup.templates += 1
+                except (OSError, ValueError):
+                    self.warmup.failed += 1
+                # let joins and commands in between templates
+                await asyncio.sleep(0)
+
+            self.warmup.guilds_done += 1
+            await asyncio.sleep(0)
+
+        self.warmup.finish()
+        log.info(self.warmup.summary())
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
+        trace = self.metrics.trace(member.guild.id, member.id)
+        trace.count("joins")
+        with trace.stage("config"):
+            settings = await self.settings.get(member.guild)
+
+        if self.bursts.offer(member, settings.burst_window, settings.burst_threshold):
+            trace.count("coalesced")
+            trace.finish()
+            return
+
+        await self.send_welcome(member, settings, trace)
+
+    async def cog_after_invoke(self, ctx):
+        # any command in this cog may have changed the guild's settings
+        if ctx.guild is not None:
+            self.settings.invalidate(ctx.guild.id)
+
+    async def send_welcome(self, member, settings, trace=None):
+        """sends the configured welcome message/image for a single member"""
         guild = member.guild
-        channel = discord.utils.get(
-            guild.channels,
-            id=await self.config.guild(guild).get_attr("welcome_msg_channel")(),
-        )
+        if trace is None:
+            trace = self.metrics.trace(guild.id, member.id)
+        channel = settings.channel(guild)
 
-        is_sending_msg = await self.config.guild(guild).get_attr("toggle_msg")()
-        is_sending_img = await self.config.guild(guild).get_attr("toggle_img")()
+        is_sending_msg = settings.toggle_msg
+        is_sending_img = settings.toggle_img
 
-        is_randomising_msg = await self.config.guild(guild).get_attr("randomise_msg")()
-        is_randomising_img = await self.config.guild(guild).get_attr("randomise_img")()
+        is_randomising_msg = settings.randomise_msg
+        is_randomising_img = settings.randomise_img
 
         # if true, process welcome message and send
-        welcome_msg = ""
+        message = None
         if is_randomising_msg:
-            welcome_msg = str(await self.get_random_welcome_msg(member))
+            message = self.get_random_welcome_msg(settings)
         elif is_sending_msg:
-            welcome_msg = str(await self.get_welcome_msg(member))
+            message = self.get_welcome_msg(settings)
 
-        mandatory = await self.config.guild(guild).get_attr("mandatory_msg_frag")()
-        welcome_msg = (
-            welcome_msg.replace("{USER}", member.mention) + ". " + str(mandatory)
-            if welcome_msg != ""
-            else str(mandatory)
-        )
+        # step down to a cheaper image, or none, when the render queue is too far behind
+        wants_img = is_sending_img or is_randomising_img
+        plan = self.plan_render(settings, trace) if wants_img else None
 
-        # if true, process welcome img and send
-        if is_randomising_img:
-            custom_img = await self.generate_random_welcome_img(member, guild)
-        elif is_sending_img:
-            custom_img = await self.generate_welcome_img(member, guild)
+        # the welcome's place in the channel is taken before anything is awaited,
+        # so it goes out in join order however long its image takes
+        item = self.outbound.reserve(channel, SendLimits.from_settings(settings))
+        try:
+            # if true, process welcome img and send
+            custom_img = None
+            filename = None
+            try:
+                if not wants_img or plan.level == TEXT:
+                    pass
+                elif is_randomising_img:
+                    custom_img, filename = await self.generate_random_welcome_img(
+                        member, guild, settings, trace, plan
+                    )
+                elif is_sending_img:
+                    custom_img, filename = await self.generate_welcome_img(
+                        member, guild, settings, trace, plan
+                    )
+            except Exception:
+                # an image that can't be made shouldn't cost the member their welcome
+                log.exception("Failed to render welcome image in guild %s", guild.id)
+                trace.count("failures")
+                trace.count("fallbacks")
+
+            send_img = custom_img is not None
+            # a welcome that lost its image, to load or to a failed render, still gets sent as text
+            lost_img = wants_img and not send_img
+            send_msg = is_sending_msg or is_randomising_msg or lost_img
+            if lost_img and message is None:
+                message = MENTIONS_ONLY
+
+            values = welcome_values([member], guild)
+            welcome_msg = clamp_message(
+                render_welcome(message, settings.mandatory_message, values)
+            )
 
-        send_msg = is_sending_msg or is_randomising_img
-        send_img = is_sending_img or is_randomising_img
+            # provides appropriate response according to settings
+            if send_msg and send_img:
+                self.outbound.fill(
+                    item, welcome_msg, discord.File(custom_img, filename=filename)
+                )
 
-        # provides appropriate response according to settings
-        if send_msg and send_img:
-            await channel.send(
-                welcome_msg, file=discord.File(custom_img, filename="output.png")
-            )
+            elif not send_msg and send_img:
+                self.outbound.fill(
+                    item,
+                    file=discord.File(custom_img, filename=filename),
+                    # sent instead if the queue falls so far behind it has to leave the image out
+                    fallback=clamp_message(
+                        render_welcome(
+                            MENTIONS_ONLY, settings.mandatory_message, values
+                        )
+                    ),
+                )
 
-        elif not send_msg and send_img:
-            await channel.send(file=discord.File(custom_img, filename="output.png"))
+            elif send_msg and not send_img:
+                self.outbound.fill(item, welcome_msg)
 
-        elif send_msg and not send_img:
-            await channel.send(welcome_msg)
+            elif not send_msg and not send_img:
+                # nothing to send, so its place is given up
+                self.outbound.fill(item)
+                item = None
+        except BaseException:
+            if item is not None and not item.filled:
+                self.outbound.fill(item)
+            raise
 
-        elif not send_msg and not send_img:
-            # do nothing
-            pass
+        if item is None:
+            trace.finish()
+        else:
+            trace.finish_when_sent(item)
+        return item
+
+    async def send_burst_welcome(self, guild, members):
+        """welcomes a batch of members who joined in a burst with one message and one montage image"""
+        settings = await self.settings.get(guild)
+        if len(members) == 1:
+            return await self.send_welcome(members[0], settings)
+
+        trace = self.metrics.trace(guild.id)
+        trace.count("bursts")
+
+        channel = settings.channel(guild)
+
+        is_sending_msg = settings.toggle_msg
+        is_sending_img = settings.toggle_img
+
+        is_randomising_msg = settings.randomise_msg
+        is_randomising_img = settings.randomise_img
+
+        message = None
+        if is_randomising_msg:
+            message = self.get_random_welcome_msg(settings)
+        elif is_sending_msg:
+            message = self.get_welcome_msg(settings)
+        # without a message of its own, a burst still mentions who joined
+        if message is None or message.empty:
+            message = MENTIONS_ONLY
+
+        # the member lists are cut short, but a message using several of them can still run long
+        welcome_msg = clamp_message(
+            render_welcome(
+                message,
+                settings.mandatory_message,
+                welcome_values(members, guild),
+            )
+        )
+
+        # its place in the channel is taken before the montage is made, so later welcomes queue behind it
+        item = self.outbound.reserve(channel, SendLimits.from_settings(settings))
+        try:
+            custom_img = None
+            picked = None
+            if is_randomising_img:
+                pool = await self.pools.get(
+                    guild.id, settings.img_avatar_cfgs, settings.img_blobs
+                )
+                picked = pool.choose()
+                if picked is not None:
+                    owner = BLOB
+                    chosen = pool.digests[picked[0]]
+                    path = self.blobs.path(chosen)
+            elif is_sending_img:
+                picked = True
+                owner = guild.id
+                chosen = "default.png"
+                path = self.data_dir / "default.png"
+
+            # under load the montage is made cheaper, or left out so the burst is welcomed by text
+            plan = None
+            if picked is not None:
+                plan = self.plan_render(settings, trace)
+            if plan is not None and plan.level != TEXT:
+                try:
+                    tiled = members[:MAX_MONTAGE_TILES]
+                    tile = montage_layout(len(tiled))[3]
+                    with trace.stage("avatar"):
+                        avatars = await asyncio.gather(
+                            *(self.avatars.get(member, tile, trace) for member in tiled)
+                        )
+                    custom_img, waited = await self.renderer.run_timed(
+                        self.render_montage_img,
+                        owner,
+                        chosen,
+                        path,
+                        avatars,
+                        plan.encoding,
+                        trace,
+                        plan.scale,
+                    )
+                    trace.add("queue", waited)
+                except Exception:
+                    log.exception(
+                        "Failed to render burst montage in guild %s", guild.id
+                    )
+                    trace.count("failures")
+                    trace.count("fallbacks")
+
+            if custom_img is not None:
+                self.outbound.fill(
+                    item,
+                    welcome_msg,
+                    discord.File(custom_img, filename=plan.encoding.filename),
+                )
+            else:
+                self.outbound.fill(item, welcome_msg)
+        except BaseException:
+            if not item.filled:
+                self.outbound.fill(item)
+            raise
+
+        trace.finish_when_sent(item)
+        return item
 
     ### Base command
     @commands.group(aliases=["cw"])
@@ -105,6 +535,18 @@ class AdvancedWelcomes(commands.Cog):
         """Base command for customised welcome."""
         pass
 
+    @customwelcome.command(name="stats")
+    async def welcome_stats(self, ctx):
+        """Shows how long each stage of this server's welcomes has been taking"""
+        report = self.metrics.report(ctx.guild.id)
+        settings = await self.settings.get(ctx.guild)
+        queued = self.outbound.depth(settings.welcome_msg_channel)
+        # the render pool is shared by every server, so its figure is the bot's
+        await ctx.send(
+            f"```\n{report}\n\nwelcomes queued in this server: {queued}, "
+            f"renders in flight across all servers: {self.renderer.in_flight}\n```"
+        )
+
     ### TOGGLE & UTLITY COMMANDS ###
     @customwelcome.group(aliases=["cfg", "config"])
     @commands.guild_only()
@@ -196,6 +638,28 @@ class AdvancedWelcomes(commands.Cog):
             + str(await self.config.guild(ctx.author.guild).get_attr("toggle_img")())
         )
 
+    @welcome_configs.command(name="renderslo")
+    @checks.mod_or_permissions(administrator=True)
+    async def set_render_slo(self, ctx, seconds: int):
+        """Sets how long a welcome image may wait to be rendered. When the render queue falls behind, images get smaller, then cheaper, then are left out. Set to 0 to always render in full"""
+        if seconds < 0:
+            await ctx.send("Seconds can't be negative.")
+            return
+
+        await self.config.guild(ctx.author.guild).render_slo.set(seconds)
+        if seconds == 0:
+            await ctx.send("Welcome images will always be rendered in full")
+        else:
+            await ctx.send(f"Welcome images will be rendered within {seconds} seconds")
+
+    @welcome_configs.command(name="toggleanimated")
+    @checks.mod_or_permissions(administrator=True)
+    async def toggle_animated(self, ctx):
+        """Call this to toggle animated welcome images for members with animated avatars"""
+        value = not await self.config.guild(ctx.author.guild).animated_avatars()
+        await self.config.guild(ctx.author.guild).animated_avatars.set(value)
+        await ctx.send("Animated welcome images set to " + str(value))
+
     @welcome_configs.command(name="togglerandommsg")
     @checks.mod_or_permissions(administrator=True)
     async def toggle_msg_randomiser(self, ctx):
@@ -241,7 +705,7 @@ class AdvancedWelcomes(commands.Cog):
         value = not value
 
         # if setting to true and there arent any images in the folder, prevent toggling to true
-        if value and len(os.listdir(self.img_dir)) < 1:
+        if value and len(await self.get_pool(ctx.guild)) < 1:
             await ctx.send(
                 "There are currently no images in the image_base folder. Add at least one before turning the randomiser on"
             )
@@ -255,6 +719,199 @@ class AdvancedWelcomes(commands.Cog):
             + str(await self.config.guild(ctx.author.guild).get_attr("randomise_img")())
         )
 
+    @welcome_configs.command(name="cachebudget")
+    @checks.is_owner()
+    async def set_cache_budget(self, ctx, megabytes: int):
+        """Sets how much memory (in MB) decoded welcome templates may use across all servers"""
+        if megabytes < 0:
+            await ctx.send("The budget can't be negative.")
+            return
+
+        await self.config.template_cache_mb.set(megabytes)
+        self.templates.set_budget(megabytes)
+        await ctx.send(f"Template cache budget set to {megabytes} MB")
+
+    @welcome_configs.command(name="renderpool")
+    @checks.is_owner()
+    async def set_render_pool(self, ctx, workers: int, queue: int):
+        """Sets how many welcome images can render at once, and how many more may wait in line"""
+        if workers < 1 or queue < 0:
+            await ctx.send("You need at least 1 worker and a queue size of 0 or more.")
+            return
+
+        await self.config.render_workers.set(workers)
+        await self.config.render_queue.set(queue)
+        self.renderer.resize(workers, queue)
+        await ctx.send(f"Render pool set to {workers} workers with a queue of {queue}")
+
+    @welcome_configs.command(name="avatarbudget")
+    @checks.is_owner()
+    async def set_avatar_budget(self, ctx, megabytes: int):
+        """Sets how much memory (in MB) cached member avatars may use across all servers"""
+        if megabytes < 0:
+            await ctx.send("The budget can't be negative.")
+            return
+
+        await self.config.avatar_cache_mb.set(megabytes)
+        self.avatars.cache.set_budget(megabytes)
+        await ctx.send(f"Avatar cache budget set to {megabytes} MB")
+
+    @welcome_configs.command(name="outputcache")
+    @checks.is_owner()
+    async def set_output_cache(self, ctx, megabytes: int, disk_megabytes: int = 0):
+        """Sets how much memory (in MB) finished welcome images may use, and how much disk (in MB) keeps them across restarts. A disk budget of 0 keeps them in memory only"""
+        if megabytes < 0 or disk_megabytes < 0:
+            await ctx.send("The budgets can't be negative.")
+            return
+
+        await self.config.output_cache_mb.set(megabytes)
+        await self.config.output_disk_mb.set(disk_megabytes)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.outputs.set_budget, megabytes, disk_megabytes
+        )
+        await ctx.send(
+            f"Output cache set to {megabytes} MB of memory and {disk_megabytes} MB of disk"
+        )
+
+    @welcome_configs.command(name="raidtest")
+    @checks.is_owner()
+    async def raid_test(self, ctx, joins: int, rate: float = 0):
+        """Simulates a raid of joins at rate per second (0 for all at once) through the real join path, recording the welcomes instead of posting them, and reports latency, throughput, queue depth and memory. The simulated joins use their own caches and don't count in [p]cw stats"""
+        if not 0 < joins <= MAX_RAID_JOINS or rate < 0:
+            await ctx.send(
+                f"Pick between 1 and {MAX_RAID_JOINS} joins and a rate of 0 or more."
+            )
+            return
+        if self.raid_running:
+            await ctx.send("A simulated raid is already running.")
+            return
+
+        self.raid_running = True
+        try:
+            await ctx.send(f"Simulating {joins} joins...")
+            guild = SimulatedGuild(
+                ctx.guild.id, ctx.guild.name, ctx.guild.member_count or 0
+            )
+            async with ctx.typing():
+                report = await run_raid(self, guild, joins, rate)
+        finally:
+            self.raid_running = False
+        await ctx.send(f"```\n{format_report(report)}\n```")
+
+    @welcome_configs.command(name="joinlog")
+    @checks.is_owner()
+    async def toggle_join_log(self, ctx):
+        """Toggles logging one structured line per welcome with its stage timings"""
+        value = not await self.config.log_joins()
+        await self.config.log_joins.set(value)
+        self.metrics.log_joins = value
+        await ctx.send("Per-join timing logs set to " + str(value))
+
+    @welcome_configs.command(name="cachestats")
+    @checks.is_owner()
+    async def get_cache_stats(self, ctx):
+        """Shows how the decoded template, avatar and finished image caches are performing"""
+        outputs = self.outputs.stats()
+        for title, stats in (
+            ("templates", self.templates.stats()),
+            ("avatars", self.avatars.cache.stats()),
+            ("welcome images", outputs),
+        ):
+            await ctx.send(
+                f"Cached {title}: {stats['entries']}\n"
+                f"Memory used: {stats['used_bytes'] / 1048576:.1f} / {stats['budget_bytes'] / 1048576:.1f} MB\n"
+                f"Hits: {stats['hits']}, misses: {stats['misses']}\n"
+                f"Evictions: {stats['evictions']}, invalidations: {stats['invalidations']}"
+            )
+        await ctx.send(
+            f"Welcome images on disk: {outputs['disk_files']}, "
+            f"{outputs['disk_used_bytes'] / 1048576:.1f} / {outputs['disk_budget_bytes'] / 1048576:.1f} MB, "
+            f"{outputs['disk_hits']} hits"
+        )
+        await ctx.send(self.warmup.summary())
+        await ctx.send("Cog load: " + self.load_summary())
+
+    @welcome_configs.command(name="burst")
+    @checks.mod_or_permissions(administrator=True)
+    async def set_burst(self, ctx, seconds: int, threshold: int):
+        """Welcomes joins together once threshold members join within the given seconds. Set seconds to 0 to turn this off"""
+        if seconds < 0 or threshold < 2:
+            await ctx.send(
+                "Seconds can't be negative and the threshold needs to be at least 2."
+            )
+            return
+
+        await self.config.guild(ctx.author.guild).burst_window.set(seconds)
+        await self.config.guild(ctx.author.guild).burst_threshold.set(threshold)
+
+        if seconds == 0:
+            await ctx.send("Join burst welcomes turned off")
+        else:
+            await ctx.send(
+                f"Joins will be welcomed together once {threshold} members join within {seconds} seconds"
+            )
+
+    @welcome_configs.command(name="output")
+    @checks.mod_or_permissions(administrator=True)
+    async def set_output_format(
+        self, ctx, fmt: str, quality: int = None, max_kb: int = 0
+    ):
+        """Sets how welcome images are encoded: png, webp or jpeg.
+
+        For png, quality is the compression level (0-9, lower is faster). For webp and jpeg it's 1-100.
+        If max_kb is set, webp and jpeg quality is lowered automatically until the image fits.
+        """
+        fmt = fmt.lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in FORMATS:
+            await ctx.send("Format must be one of: " + ", ".join(FORMATS))
+            return
+
+        if quality is None:
+            quality = DEFAULT_QUALITY[fmt]
+        low, high = QUALITY_RANGE[fmt]
+        if not low <= quality <= high:
+            await ctx.send(f"Quality for {fmt} must be between {low} and {high}.")
+            return
+
+        if max_kb < 0:
+            await ctx.send("The size budget can't be negative.")
+            return
+
+        await self.config.guild(ctx.author.guild).output_format.set(fmt)
+        await self.config.guild(ctx.author.guild).output_quality.set(quality)
+        await self.config.guild(ctx.author.guild).output_max_kb.set(max_kb)
+
+        budget = f", at most {max_kb} KB" if max_kb else ""
+        await ctx.send(
+            f"Welcome images will be sent as {fmt} (quality {quality}{budget})"
+        )
+
+    @welcome_configs.command(name="sendqueue")
+    @checks.mod_or_permissions(administrator=True)
+    async def set_send_queue(self, ctx, depth: int, policy: str, seconds: int):
+        """Limits how far welcomes can fall behind during a raid.
+
+        Once more than depth welcomes are waiting, or the oldest has waited longer than seconds, the policy applies:
+        collapse merges waiting text-only welcomes into one message, sending the oldest image welcomes as text if it has to.
+        drop discards the oldest welcomes, so those members are never welcomed.
+        """
+        policy = policy.lower()
+        if policy not in POLICIES:
+            await ctx.send("Policy must be one of: " + ", ".join(POLICIES))
+            return
+        if depth < 1 or seconds < 1:
+            await ctx.send("Depth and seconds need to be at least 1.")
+            return
+
+        await self.config.guild(ctx.author.guild).send_queue_depth.set(depth)
+        await self.config.guild(ctx.author.guild).send_queue_policy.set(policy)
+        await self.config.guild(ctx.author.guild).send_latency_budget.set(seconds)
+        await ctx.send(
+            f"Welcome queue set to {depth} messages or {seconds} seconds, then {policy}"
+        )
+
     @welcome_configs.command(name="currentgreet")
     @checks.mod_or_permissions(administrator=True)
     async def get_current_greeting(self, ctx):
@@ -317,6 +974,8 @@ class AdvancedWelcomes(commands.Cog):
     @checks.mod_or_permissions(administrator=True)
     async def set_text(self, ctx, txt):
         """Sets the message to be sent when a user joins the server. This must be set before any welcome message is sent"""
+        if not await self.check_placeholders(ctx, txt):
+            return
         await self.config.guild(ctx.author.guild).def_welcome_msg.set(txt)
         new_welcome_message = "New welcome message is : {}"
         await ctx.send(
@@ -331,6 +990,13 @@ class AdvancedWelcomes(commands.Cog):
         """Sets the image to be sent when a user joins the server. This must be set before any welcome image is sent. Please only attach 1 image, make it fit into the template provided"""
         base_img_path = self.data_dir / "default.png"
 
+        # reject a missing or oversized attachment before asking for anything
+        try:
+            image = self.uploads.check_attachments(ctx.message.attachments)
+        except InvalidUpload as e:
+            await ctx.reply(str(e))
+            return
+
         # user needs to specify where in the image should be the center of the joining user's avatar should be
         await ctx.send("reply to this message with the pixel x-coordinate")
         x_coord = -1
@@ -376,14 +1042,13 @@ class AdvancedWelcomes(commands.Cog):
             )
             return
 
-        image = None
-        if len(ctx.message.attachments) == 1:
-            image = ctx.message.attachments[0]
-            await image.save(base_img_path)
-        else:
-            await ctx.reply(
-                "You need to attach exactly 1 image in the message that uses this command"
-            )
+        # the cache maps default.png's raw copy, and windows won't replace a file while it's mapped
+        self.templates.invalidate(name="default.png")
+        # checks the upload and resizes it to the template size before it replaces the current base
+        if not await self.install_upload(
+            ctx, image, self.store_default_img, [x_coord, y_coord], TEMPLATE_SIZE
+        ):
+            return
 
         # ok now set the coordinate for where to put the avatar
         fetched_coord_dict = await self.config.guild(ctx.author.guild).get_attr(
@@ -394,17 +1059,19 @@ class AdvancedWelcomes(commands.Cog):
             fetched_coord_dict
         )
 
-        # Performing necessary checks to ensure that this base can produce a good generated image
-        temp = Image.open(base_img_path)
-        temp_resize = temp.resize((1193, 671), 2)
-        temp_resize.save(base_img_path, dpi=(72, 72))
-
-        await image.save(base_img_path)
-
-        # Performing necessary checks to ensure that this base can produce a good generated image
-        temp = Image.open(base_img_path)
-        temp_resize = temp.resize((1193, 671), 2)
-        temp_resize.save(base_img_path, dpi=(72, 72))
+        # default.png is shared, so every guild's cached copy is stale now, including any loaded during the write
+        self.templates.invalidate(name="default.png")
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.outputs.invalidate, "default.png"
+        )
+        await self.renderer.run(
+            self.templates.compiled,
+            ctx.guild.id,
+            "default.png",
+            base_img_path,
+            [x_coord, y_coord],
+            self.assets,
+        )
 
         await ctx.reply("Welcome Image base set to: ", file=discord.File(base_img_path))
 
@@ -420,14 +1087,19 @@ class AdvancedWelcomes(commands.Cog):
         """adds another image to the random image pool"""
         # determine potential file name
         file_name = f"{name}.png"
-        img_path = self.img_dir / str(ctx.guild.id) / file_name
 
-        if os.path.exists(img_path):
+        if file_name in await self.get_pool(ctx.guild):
             await ctx.reply(
                 "This name is already in use! For ease of management, please use another name."
             )
             return
 
+        try:
+            image = self.uploads.check_attachments(ctx.message.attachments)
+        except InvalidUpload as e:
+            await ctx.reply(str(e))
+            return
+
         # user needs to specify where in the image should be the center of the joining user's avatar should be
         await ctx.send("reply to this message with the pixel x-coordinate")
         x_coord = -1
@@ -487,7 +1159,7 @@ class AdvancedWelcomes(commands.Cog):
 
         try:
             radius = int(radius.content)
-            assert radius >= 0
+            assert radius > 0
             await ctx.send(f"avatar radius:{radius}")
         except:
             await ctx.send(
@@ -495,14 +1167,11 @@ class AdvancedWelcomes(commands.Cog):
             )
             return
 
-        image = None
-        if len(ctx.message.attachments) == 1:
-            image = ctx.message.attachments[0]
-            await image.save(img_path)
-        else:
-            await ctx.reply(
-                "You need to attach exactly 1 image in the message that uses this command"
-            )
+        # stored by content, so artwork another guild already uploaded isn't stored twice
+        digest = await self.install_upload(
+            ctx, image, self.blobs.add, [x_coord, y_coord, radius]
+        )
+        if digest is None:
             return
 
         # ok now set the coordinate for where to put the avatar
@@ -513,17 +1182,101 @@ class AdvancedWelcomes(commands.Cog):
         await self.config.guild(ctx.author.guild).img_avatar_cfgs.set(
             fetched_coord_dict
         )
-
-        # Performing necessary checks to ensure that this base can produce a good generated image
-        # temp = Image.open(img_path)
-        # temp_resize = temp.resize((1193, 671), 2)
-        # temp_resize.save(img_path, dpi=(72, 72))
+        await self.set_blob_names(ctx.guild, {file_name: digest})
+        self.pools.add(ctx.guild.id, file_name, [x_coord, y_coord, radius], digest)
+        await self.renderer.run(
+            self.templates.compiled,
+            BLOB,
+            digest,
+            self.blobs.path(digest),
+            [x_coord, y_coord, radius],
+            self.assets,
+        )
         await ctx.reply("image added")
 
+    @addContent.command(name="imgs")
+    @checks.mod_or_permissions(administrator=True)
+    async def add_imgs(self, ctx):
+        """Adds many images to the random image pool at once. Attach a zip of the images with a manifest.csv (or manifest.json) giving name, x, y and radius for each one"""
+        try:
+            archive = self.uploads.check_attachments(
+                ctx.message.attachments, MAX_ARCHIVE_BYTES
+            )
+        except InvalidUpload as e:
+            await ctx.reply(str(e))
+            return
+
+        scratch_dir = self.blobs.blob_dir
+        pool = await self.get_pool(ctx.guild)
+
+        async with ctx.typing():
+            try:
+                archive_path = await self.uploads.download(
+                    archive, scratch_dir, MAX_ARCHIVE_BYTES
+                )
+            except InvalidUpload as e:
+                await ctx.reply("Import cancelled. " + str(e))
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                log.exception("Failed to download template archive %s", archive.url)
+                await ctx.reply(
+                    "Import cancelled. The archive couldn't be downloaded, try again."
+                )
+                return
+
+            try:
+                imported, failures = await import_archive(
+                    archive_path,
+                    scratch_dir,
+                    set(pool.names),
+                    self.assets.size,
+                    self.blobs.add,
+                )
+            except InvalidUpload as e:
+                await ctx.reply("Import cancelled. " + str(e))
+                return
+            finally:
+                os.remove(archive_path)
+
+            # one config write for the whole archive
+            if imported:
+                fetched_coord_dict = await self.config.guild(ctx.author.guild).get_attr(
+                    "img_avatar_cfgs"
+                )()
+                fetched_coord_dict.update(
+                    {entry.name: entry.coords for entry, _ in imported}
+                )
+                await self.config.guild(ctx.author.guild).img_avatar_cfgs.set(
+                    fetched_coord_dict
+                )
+                await self.set_blob_names(
+                    ctx.guild, {entry.name: digest for entry, digest in imported}
+                )
+                for entry, digest in imported:
+                    pool.add(entry.name, entry.coords, digest)
+
+        report = f"Imported {len(imported)} of {len(imported) + len(failures)} images."
+        if not failures:
+            await ctx.reply(report)
+            return
+
+        details = "\n".join(f"{name}: {reason}" for name, reason in failures)
+        if len(report) + len(details) < 1900:
+            await ctx.reply(report + "\n" + details)
+        else:
+            await ctx.reply(
+                report + " The failures are attached.",
+                file=discord.File(
+                    io.BytesIO(details.encode()), filename="import_failures.txt"
+                ),
+            )
+
     @addContent.command(name="msg")
     @checks.mod_or_permissions(administrator=True)
     async def add_msg(self, ctx, message):
         """adds another message to the random message pool"""
+        if not await self.check_placeholders(ctx, message):
+            return
         local_welcome_msgs = await self.config.guild(ctx.author.guild).get_attr(
             "message_pool"
         )()
@@ -543,21 +1296,30 @@ class AdvancedWelcomes(commands.Cog):
     @removeContent.command(name="img")
     async def remove_img(self, ctx, imgName: str):
         """Removes the specified image from the pool"""
-        await self.ensureCurrentServerHasImgCache(ctx.channel)
         fileName = f"{imgName}.png"
-        try:
-            os.remove(self.img_dir / str(ctx.guild.id) / fileName)
-        except:
+        pool = await self.get_pool(ctx.guild)
+        digest = pool.digests.get(fileName)
+        if digest is None:
             await ctx.reply("The named image doesn't exist")
             return
 
         # update coord info; remove
         coordInfo = await self.config.guild(ctx.guild).get_attr("img_avatar_cfgs")()
-        coordInfo.pop(fileName)
+        coordInfo.pop(fileName, None)
         await self.config.guild(ctx.author.guild).img_avatar_cfgs.set(coordInfo)
-
-        if len(os.listdir(self.img_dir / str(ctx.channel.guild.id))) == 0:
-            await self.config.guild(ctx.author.guild).toggle_img.set(False)
+        await self.set_blob_names(ctx.guild, {fileName: None})
+        pool.remove(fileName)
+
+        # the artwork itself only goes once no guild uses it
+        if self.blobs.release(digest):
+            # dropped first, since windows won't delete a raw copy the cache still maps
+            self.templates.invalidate(BLOB, digest)
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, self.blobs.discard, digest):
+                await loop.run_in_executor(None, self.outputs.invalidate, digest)
+
+        if len(pool) == 0:
+            await self.config.guild(ctx.author.guild).randomise_img.set(False)
             await ctx.reply("Last image deleted. Image randomiser turned off.")
 
         await ctx.reply("Image sucessfully removed")
@@ -619,28 +1381,75 @@ class AdvancedWelcomes(commands.Cog):
             ),
         )
 
+    @viewContent.command(name="preview")
+    async def preview_img(self, ctx, imgName: str = None):
+        """Shows the welcome image you would get, on the base image or on the named image from the pool"""
+        settings = await self.settings.get(ctx.guild)
+        if imgName is None:
+            owner, name = ctx.guild.id, "default.png"
+            path = self.data_dir / "default.png"
+            coords = settings.img_avatar_cfgs.get("default.png")
+            if coords is None or not path.exists():
+                await ctx.reply("No base image has been set yet.")
+                return
+        else:
+            pool = await self.get_pool(ctx.guild)
+            digest = pool.digests.get(f"{imgName}.png")
+            if digest is None:
+                await ctx.reply("The named image doesn't exist")
+                return
+            owner, name = BLOB, digest
+            path = self.blobs.path(digest)
+            coords = settings.img_avatar_cfgs[f"{imgName}.png"]
+
+        # rendered just as a join would be, so the cache built up here serves real joins and vice versa
+        plan = RenderPlan(FULL, 1.0, OutputEncoding.from_settings(settings))
+        async with ctx.typing():
+            generated, filename = await self.render_for_member(
+                ctx.author, owner, name, path, coords, settings, NULL_TRACE, plan
+            )
+        await ctx.reply(file=discord.File(generated, filename=filename))
+
     @viewContent.command(name="listimgs")
-    async def listImg(self, ctx):
-        """Display a list of all the images in this server's image cache"""
-        await self.ensureCurrentServerHasImgCache(ctx.channel)
+    async def listImg(self, ctx, page: int = 1):
+        """Shows a contact sheet of the images in this server's image pool, with where each avatar goes"""
+        pool = await self.get_pool(ctx.guild)
+        names = sorted(pool.names)
+        if len(names) == 0:
+            await ctx.reply("No images added yet.")
+            return
 
-        rawImgList = []
-        for imagePath in pathlib.Path(
-            self.img_dir / str(ctx.channel.guild.id)
-        ).iterdir():
-            rawImgList.append(imagePath.stem)
+        pages = page_count(len(names))
+        if not 1 <= page <= pages:
+            await ctx.reply(f"Pick a page from 1 to {pages}.")
+            return
 
-        listOfImages = ""
+        version = pool.version
+        sheet = self.previews.get(ctx.guild.id, version, page)
+        if sheet is None:
+            first = (page - 1) * PAGE_SIZE
+            entries = [
+                (name, self.blobs.path(pool.digests[name]), pool.coords[name])
+                for name in names[first : first + PAGE_SIZE]
+            ]
+            sheet = await self.renderer.run(
+                render_contact_sheet,
+                entries,
+                self.raw_templates.load,
+                self.assets.size,
+                first + 1,
+            )
+            self.previews.put(ctx.guild.id, version, page, sheet)
 
-        index = 0
-        for imgName in rawImgList:
-            listOfImages = listOfImages + f"\n{index + 1}: " + imgName
-            index += 1
+        await ctx.reply(
+            f"Page {page}/{pages}, {len(names)} images",
+            file=discord.File(io.BytesIO(sheet), filename="contact_sheet.jpg"),
+        )
 
-        if len(listOfImages) == 0:
-            await ctx.reply("No images added yet.")
-            return
-        await ctx.reply(listOfImages)
+    @viewContent.command(name="placeholders")
+    async def list_placeholders(self, ctx):
+        """Lists the placeholders welcome messages can use"""
+        await ctx.reply(placeholder_help())
 
     @viewContent.command(name="listmsgs")
     async def listMsgs(self, ctx):
@@ -663,6 +1472,8 @@ class AdvancedWelcomes(commands.Cog):
     @checks.mod_or_permissions(administrator=True)
     async def set_mandatory_text(self, ctx, txt):
         """Sets the mandatory message snippet to be sent with the message thats sent when a user joins the server"""
+        if not await self.check_placeholders(ctx, txt):
+            return
         await self.config.guild(ctx.author.guild).mandatory_msg_frag.set(txt)
         new_welcome_message = "New mandatory message snippet is : {}"
         await ctx.send(
@@ -675,114 +1486,234 @@ class AdvancedWelcomes(commands.Cog):
 
     ### HELPER FUNCTIONS
     ### CUSTOM WELCOME PICTURE GENERATION ###
-    async def generate_welcome_img(self, user, guild):
-        """creates an image for the specific player using their avatar and the set base image, then returns it"""
-        base = Image.open(self.data_dir / "default.png")
-        mask = Image.open(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "MASK.png")
+    def plan_render(self, settings, trace):
+        """picks how much of a welcome image to render from the render queue's expected wait, counting any downgrade"""
+        plan = plan_render(
+            self.renderer.estimated_wait(),
+            settings.render_slo,
+            OutputEncoding.from_settings(settings),
         )
-        border_overlay = Image.open(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "BORDER.png")
+        if plan.degraded:
+            trace.count(plan.level)
+        return plan
+
+    async def generate_welcome_img(self, user, guild, settings, trace, plan):
+        """creates an image for the specific player using their avatar and the set base image, then returns it with its file name"""
+        # get coords
+        coords = settings.img_avatar_cfgs.get("default.png")
+
+        return await self.render_for_member(
+            user,
+            guild.id,
+            "default.png",
+            self.data_dir / "default.png",
+            coords,
+            settings,
+            trace,
+            plan,
         )
-        border_overlay_mask = Image.open(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "BORDER_mask.png")
-        )
-        # get avatar from User
-        avatar: bytes
-
-        # try:
-        #     async with self.session.get(str(user.avatar_url), headers = self.headers) as webp:
-        #         avatar = await webp.read()
-        # except aiohttp.ClientResponseError:
-        #     pass
 
-        avatar = await user.avatar.read()
+    async def generate_random_welcome_img(self, user, guild, settings, trace, plan):
+        """creates an image for the specific player using their avatar and an image from the random image pool, then returns it with its file name"""
+        pool = await self.pools.get(
+            guild.id, settings.img_avatar_cfgs, settings.img_blobs
+        )
+        picked = pool.choose()
+        if picked is None:
+            return None, None
+
+        # get coords
+        chosen, coords = picked
+        digest = pool.digests[chosen]
+
+        return await self.render_for_member(
+            user,
+            BLOB,
+            digest,
+            self.blobs.path(digest),
+            coords,
+            settings,
+            trace,
+            plan,
+        )
 
-        with Image.open(io.BytesIO(avatar)) as retrieved_avatar:
-            if not retrieved_avatar:
-                return
-            else:
-                # get coords
-                coordInfo = await self.config.guild(guild).get_attr("img_avatar_cfgs")()
-                coords = coordInfo.get("default.png")
-                # base = base.resize((1193, 671), 2)
-                retrieved_avatar = retrieved_avatar.resize((coords[2], coords[2]), 1)
-                base.paste(border_overlay, (coords[0], coords[1]), border_overlay_mask)
-                base.paste(retrieved_avatar, (coords[0], coords[1]), mask)
-                generated = io.BytesIO()
-                base.save(generated, format="png")
-                generated.seek(0)
-                return generated
-
-    async def generate_random_welcome_img(self, user, guild):
-        """creates an image for the specific player using their avatar and an image from the random image pool, then returns it"""
-        chosen = random.choice(os.listdir(self.img_dir / str(guild.id)))
-        base = Image.open(self.img_dir / str(guild.id) / chosen)
-        mask = Image.open(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "MASK.png")
-        )
-        border_overlay = Image.open(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "BORDER.png")
-        )
-        border_overlay_mask = Image.open(
-            os.path.join(os.path.dirname(os.path.realpath(__file__)), "BORDER_mask.png")
-        )
-        # get avatar from User
-        avatar: bytes
-
-        # try:
-        #     async with self.session.get(str(user.avatar_url), headers = self.headers) as webp:
-        #         avatar = await webp.read()
-        # except aiohttp.ClientResponseError:
-        #     pass
-
-        avatar = await user.avatar.read()
-
-        with Image.open(io.BytesIO(avatar)) as retrieved_avatar:
-            if not retrieved_avatar:
-                return
-            else:
-                # get coords
-                coordInfo = await self.config.guild(guild).get_attr("img_avatar_cfgs")()
-                coords = coordInfo.get(chosen)
-                # base = base.resize((1193, 671), 2) default (434,0)
-                retrieved_avatar = retrieved_avatar.resize((coords[2], coords[2]), 1)
-                base.paste(
-                    border_overlay,
-                    (coords[0], coords[1]),
-                    border_overlay_mask,
+    async def render_for_member(
+        self, user, owner, name, path, coords, settings, trace, plan
+    ):
+        """
+        renders the welcome image for one member on the given template as planned, animated if the guild allows it and there's time.
+        owner and name key the template in the cache: the guild id and file name, or BLOB and the blob hash
+        """
+        radius = avatar_radius(coords, self.assets)
+        asset = user.display_avatar
+        # blobs are named by their content, other templates change in place so their mtime is part of the key
+        version = None if owner == BLOB else os.stat(path).st_mtime_ns
+
+        if settings.animated_avatars and not plan.degraded and asset.is_animated():
+            key = output_key(owner, name, version, coords, asset.key, 1.0, "gif")
+            cached = await self.outputs.get(key)
+            if cached is not None:
+                trace.count("output_hits")
+                return cached, "output.gif"
+            try:
+                with trace.stage("avatar"):
+                    data = await self.avatars.download_animated(asset, radius)
+                generated, waited = await self.renderer.run_timed(
+                    self.render_animated_img, owner, name, path, coords, data, key
                 )
-                base.paste(retrieved_avatar, (coords[0], coords[1]), mask)
-                generated = io.BytesIO()
-                base.save(generated, format="png")
-                generated.seek(0)
-                return generated
+                trace.add("queue", waited)
+                trace.count("animated")
+                return generated, "output.gif"
+            except AnimationTooExpensive:
+                # too long or too big to animate, so the member gets a still image
+                trace.count("fallbacks")
+
+        # the same member on the same template, rendered the same way, is the image already sent
+        key = output_key(
+            owner, name, version, coords, asset.key, plan.scale, plan.encoding
+        )
+        cached = await self.outputs.get(key)
+        if cached is not None:
+            trace.count("output_hits")
+            return cached, plan.encoding.filename
+
+        # get avatar from User, already scaled to fit
+        with trace.stage("avatar"):
+            avatar = await self.avatars.get(user, radius, trace)
+
+        generated, waited = await self.renderer.run_timed(
+            self.render_welcome_img,
+            owner,
+            name,
+            path,
+            coords,
+            avatar,
+            plan.encoding,
+            trace,
+            plan.scale,
+            key,
+        )
+        trace.add("queue", waited)
+        return generated, plan.encoding.filename
+
+    def render_welcome_img(
+        self,
+        guild_id,
+        name,
+        path,
+        coords,
+        avatar,
+        encoding,
+        trace=None,
+        scale=1.0,
+        cache_key=None,
+    ):
+        """
+        pastes the avatar onto the compiled template, shrinks it by scale and encodes the result,
+        keeping it in the output cache under cache_key if given. blocking, so it runs on a render worker
+        """
+        trace = trace or NULL_TRACE
+        with trace.stage("render"):
+            compiled = self.templates.compiled(
+                guild_id, name, path, coords, self.assets, trace
+            )
+            rendered = scale_image(compiled.render(avatar), scale)
+        with trace.stage("encode"):
+            generated = encode_image(rendered, encoding)
+        if cache_key is not None:
+            self.outputs.put(cache_key, generated)
+        trace.count("renders")
+        return generated
+
+    def render_animated_img(self, guild_id, name, path, coords, data, cache_key=None):
+        """
+        streams an animated avatar onto the compiled template as a gif, keeping it in the output cache under cache_key if given.
+        blocking, so it runs on a render worker. raises AnimationTooExpensive past the animation limits
+        """
+        compiled = self.templates.compiled(guild_id, name, path, coords, self.assets)
+        generated = render_animated(compiled, data)
+        if cache_key is not None:
+            self.outputs.put(cache_key, generated)
+        return generated
+
+    def render_montage_img(
+        self, guild_id, name, path, avatars, encoding, trace=None, scale=1.0
+    ):
+        """
+        tiles every avatar in a burst onto the template, shrinks it by scale and encodes the result.
+        blocking, so it runs on a render worker
+        """
+        trace = trace or NULL_TRACE
+        with trace.stage("render"):
+            base = self.templates.get(guild_id, name, path).copy()
+            tile_avatars(base, avatars, self.assets)
+            base = scale_image(base, scale)
+        with trace.stage("encode"):
+            generated = encode_image(base, encoding)
+        trace.count("renders")
+        return generated
 
     ### CUSTOM WELCOME MESSAGE GENERATION ###
-    async def get_welcome_msg(self, author):
-        msg = await self.config.guild(author.guild).get_attr("def_welcome_msg")()
-        return msg
+    def get_welcome_msg(self, settings):
+        return settings.welcome_message
 
-    async def get_random_welcome_msg(self, author):
-        local_welcome_msgs = await self.config.guild(author.guild).get_attr(
-            "message_pool"
-        )()
-        return random.choice(local_welcome_msgs)
+    def get_random_welcome_msg(self, settings):
+        return random.choice(settings.pool_messages)
+
+    async def check_placeholders(self, ctx, text):
+        """compiles a message template, replying with the problem and returning False if it's invalid"""
+        try:
+            compile_message(text, strict=True)
+        except InvalidPlaceholder as error:
+            await ctx.reply(
+                f"{{{error.name}}} isn't a placeholder. You can use:\n"
+                + placeholder_help()
+            )
+            return False
+        return True
+
+    async def get_pool(self, guild):
+        """returns the guild's random image pool manifest, loading it if needed"""
+        settings = await self.settings.get(guild)
+        return await self.pools.get(
+            guild.id, settings.img_avatar_cfgs, settings.img_blobs
+        )
 
-    async def ensureCurrentServerHasImgCache(self, channel: discord.channel):
+    async def install_upload(self, ctx, attachment, commit, coords, size=None):
         """
-        Check if there is a folder in the image cache for the associated server. If one doesn't exist, creates it.
+        runs an attachment through the upload pipeline and returns what commit made of the normalized image.
+        replies with the reason and returns None if it was rejected
         """
-        idStr = str(channel.guild.id)
-        fp = self.img_dir / idStr
-        if os.path.exists(fp):
-            return
-
         try:
-            os.makedirs(fp, exist_ok=True)
-            await channel.send(
-                "No image cache folder found for this server! Created one"
+            return await self.uploads.install(
+                attachment,
+                self.blobs.blob_dir,
+                commit,
+                coords,
+                self.assets.size,
+                size,
             )
-
-        except OSError as info:
-            await channel.send("Something went wrong...")
+        except InvalidUpload as e:
+            await ctx.reply("Adding image cancelled. " + str(e))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            log.exception("Failed to download template upload %s", attachment.url)
+            await ctx.reply(
+                "Adding image cancelled. The attachment couldn't be downloaded, try again."
+            )
+        return None
+
+    def store_default_img(self, img):
+        """writes a normalized image over default.png. blocking"""
+        path = self.data_dir / "default.png"
+        write_template(img, path, self.raw_templates)
+        return path
+
+    async def set_blob_names(self, guild, names):
+        """points the guild's template names at blob hashes, or removes them where the hash is None"""
+        img_blobs = await self.config.guild(guild).get_attr("img_blobs")()
+        for name, digest in names.items():
+            if digest is None:
+                img_blobs.pop(name, None)
+            else:
+                img_blobs[name] = digest
+        await self.config.guild(guild).img_blobs.set(img_blobs)
@@ -0,0 +1,110 @@
+# renders animated welcome gifs from animated avatars, one frame at a time and within fixed budgets
+
+import io
+import time
+from typing import NamedTuple
+
+
+class AnimationLimits(NamedTuple):
+    """
+    hard caps for an animated welcome. going past any of them falls back to a static render
+    """
+
+    max_frames: int = 40
+    max_fps: int = 15
+    # the output is scaled down to this width
+    max_width: int = 600
+    # biggest source frame (in pixels) worth decoding
+    max_source_pixels: int = 1024 * 1024
+    max_bytes: int = 4 * 1024 * 1024
+    time_budget: float = 4.0
+
+
+class AnimationTooExpensive(Exception):
+    """
+    raised when an animated render would break its limits, so the caller renders a static image instead
+    """
+
+
+def _sample_frames(source, limits):
+    """
+    yields (frame, duration_ms) from source, merging frames so the output stays under max_fps
+    and stopping after max_frames. only the current frame is ever decoded
+    """
+    from PIL import ImageSequence
+
+    min_duration = 1000 / limits.max_fps
+    pending = 0
+    emitted = 0
+
+    for frame in ImageSequence.Iterator(source):
+        duration = frame.info.get("duration", 100) or 100
+        pending += duration
+        if pending < min_duration:
+            continue
+
+        yield frame, int(pending)
+        pending = 0
+        emitted += 1
+        if emitted >= limits.max_frames:
+            return
+
+
+def render_animated(compiled, avatar_data, limits=AnimationLimits()):
+    """
+    streams the animated avatar's frames onto the compiled template and encodes them as a looping gif.
+    returns the gif as a rewound BytesIO, or raises AnimationTooExpensive
+    """
+    from PIL import Image
+
+    deadline = time.perf_counter() + limits.time_budget
+
+    # work at the output size so every per-frame step is as cheap as possible
+    scale = min(1.0, limits.max_width / compiled.image.width)
+    size = (round(compiled.image.width * scale), round(compiled.image.height * scale))
+    radius = max(1, round(compiled.radius * scale))
+    box = (round(compiled.box[0] * scale), round(compiled.box[1] * scale))
+    base = compiled.image.convert("RGB").resize(size, Image.BILINEAR)
+    mask = compiled.mask.resize((radius, radius), Image.BILINEAR)
+
+    with Image.open(io.BytesIO(avatar_data)) as source:
+        if not getattr(source, "is_animated", False):
+            raise AnimationTooExpensive("avatar isn't animated")
+        if source.width * source.height > limits.max_source_pixels:
+            raise AnimationTooExpensive("avatar frames are too large")
+
+        def frames():
+            for frame, duration in _sample_frames(source, limits):
+                if time.perf_counter() > deadline:
+                    raise AnimationTooExpensive("ran out of time")
+
+                canvas = base.copy()
+                canvas.paste(
+                    frame.convert("RGBA").resize((radius, radius), Image.BILINEAR),
+                    box,
+                    mask,
+                )
+                # fast octree keeps a palette per frame at about the cost of mapping to a shared one
+                out = canvas.quantize(colors=255, method=Image.Quantize.FASTOCTREE)
+                out.info["duration"] = duration
+                yield out
+
+        stream = frames()
+        first = next(stream, None)
+        if first is None:
+            raise AnimationTooExpensive("avatar has no frames")
+
+        generated = io.BytesIO()
+        first.save(
+            generated,
+            format="GIF",
+            save_all=True,
+            append_images=stream,
+            loop=0,
+            optimize=False,
+        )
+
+    if generated.tell() > limits.max_bytes:
+        raise AnimationTooExpensive("gif is too large")
+    generated.seek(0)
+    return generated
@@ -0,0 +1,61 @@
+# generates the avatar mask and border overlays for any avatar size, kept resident once made
+
+import threading
+
+# avatar size used when a template didn't save a radius
+DEFAULT_SIZE = 325
+# circle radii as a fraction of the avatar box, matching the pngs the overlays used to be scaled from
+AVATAR_CIRCLE = 0.459
+BORDER_CIRCLE = 0.4735
+BORDER_COLOUR = (0, 0, 0, 255)
+# circles are drawn this many times larger and scaled down, which anti-aliases their edge
+SUPERSAMPLE = 4
+
+
+def circle_mask(size, fraction):
+    """
+    returns an anti-aliased single channel mask of a circle centred in a size x size box,
+    with a radius of fraction * size
+    """
+    from PIL import Image, ImageDraw
+
+    big = size * SUPERSAMPLE
+    inset = big * (0.5 - fraction)
+    mask = Image.new("L", (big, big), 0)
+    ImageDraw.Draw(mask).ellipse((inset, inset, big - inset, big - inset), fill=255)
+    return mask.resize((size, size), Image.BOX)
+
+
+class AssetRegistry:
+    """
+    read-only registry of the avatar mask and border overlays, generated and cached per avatar radius.
+    masks are single channel, which PIL pastes through faster than an RGBA mask
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self._scaled = {}
+        self._lock = threading.Lock()
+
+    def overlays(self, radius):
+        """
+        returns (mask, border, border_mask) for the given avatar radius.
+        the returned images are shared and must not be modified
+        """
+        radius = int(radius) if radius else self.size
+        scaled = self._scaled.get(radius)
+        if scaled is not None:
+            return scaled
+
+        with self._lock:
+            scaled = self._scaled.get(radius)
+            if scaled is None:
+                from PIL import Image
+
+                scaled = (
+                    circle_mask(radius, AVATAR_CIRCLE),
+                    Image.new("RGBA", (radius, radius), BORDER_COLOUR),
+                    circle_mask(radius, BORDER_CIRCLE),
+                )
+                self._scaled[radius] = scaled
+        return scaled
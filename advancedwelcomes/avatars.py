@@ -0,0 +1,96 @@
+# downloads member avatars at the size a render needs and keeps them decoded in memory
+
+import asyncio
+import io
+import aiohttp
+from .lru import ByteLRU, image_nbytes
+
+DEFAULT_AVATAR_CACHE_MB = 32
+MAX_CONCURRENT_DOWNLOADS = 8
+DOWNLOAD_TIMEOUT = 10
+
+# sizes the discord cdn will serve an avatar at
+CDN_SIZES = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def cdn_size_for(radius):
+    """
+    returns the smallest cdn size that still covers the given radius
+    """
+    for size in CDN_SIZES:
+        if size >= radius:
+            return size
+    return CDN_SIZES[-1]
+
+
+def decode_avatar(data, radius):
+    """
+    decodes downloaded avatar bytes and scales them to radius x radius. blocking
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as retrieved_avatar:
+        return retrieved_avatar.convert("RGBA").resize((radius, radius), 1)
+
+
+class AvatarFetcher:
+    """
+    fetches avatars through one pooled http session with a timeout and a cap on concurrent downloads.
+    decoded, resized avatars are kept in an lru keyed by avatar hash and radius, so repeat renders cost no traffic
+    """
+
+    def __init__(
+        self,
+        session,
+        renderer,
+        budget_mb=DEFAULT_AVATAR_CACHE_MB,
+        max_concurrency=MAX_CONCURRENT_DOWNLOADS,
+    ):
+        self.session = session
+        self.renderer = renderer
+        self.cache = ByteLRU(budget_mb)
+        self.timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # a header to successfully download user avatars for use
+        self.headers = {"User-agent": "Mozilla/5.0"}
+
+    async def get(self, user, radius, trace=None):
+        """
+        returns the user's avatar as an RGBA image of radius x radius. the image is shared, don't modify it
+        """
+        asset = user.display_avatar
+        key = (asset.key, radius)
+
+        avatar = self.cache.get(key)
+        if avatar is not None:
+            if trace is not None:
+                trace.count("cache_hits")
+            return avatar
+
+        data = await self.download(asset, radius)
+        avatar = await self.renderer.run(decode_avatar, data, radius)
+        self.cache.put(key, avatar, image_nbytes(avatar))
+        return avatar
+
+    async def download(self, asset, radius):
+        """
+        downloads the avatar at the smallest size that covers radius
+        """
+        url = asset.with_static_format("png").with_size(cdn_size_for(radius)).url
+        return await self._fetch(url)
+
+    async def download_animated(self, asset, radius):
+        """
+        downloads an animated avatar as a gif at the smallest size that covers radius. not cached,
+        the frames are only ever streamed through once
+        """
+        url = asset.with_format("gif").with_size(cdn_size_for(radius)).url
+        return await self._fetch(url)
+
+    async def _fetch(self, url):
+        async with self._slots:
+            async with self.session.get(
+                url, headers=self.headers, timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                return await response.read()
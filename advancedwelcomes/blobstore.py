@@ -0,0 +1,143 @@
+# content addressed storage for pool templates, so the same artwork is kept once however many guilds use it
+
+import hashlib
+import os
+import threading
+from collections import Counter
+from .uploads import write_template
+
+# the cache owner for blob templates, in place of a guild id, so every guild using a blob shares its cache entries
+BLOB = "blob"
+
+
+def digest_of(img):
+    """
+    hashes a normalized RGBA template by its size and pixels
+    """
+    sha = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+    sha.update(img.tobytes())
+    return sha.hexdigest()
+
+
+class BlobStore:
+    """
+    template pngs in blob_dir named by the hash of their pixels.
+    guilds map their own names to hashes, and refs counts how many names point at each blob,
+    so a blob is deleted only when its last name goes
+    """
+
+    def __init__(self, blob_dir, raw_store=None):
+        self.blob_dir = blob_dir
+        self.raw_store = raw_store
+        self.refs = Counter()
+        self._lock = threading.Lock()
+        # hashes being written by an add, which other adds of the same artwork wait on
+        self._writing = set()
+        self._written = threading.Condition(self._lock)
+        os.makedirs(blob_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.blob_dir, digest + ".png")
+
+    def add(self, img):
+        """
+        stores a normalized template unless an identical one is already stored, and returns its hash.
+        takes a reference on the blob for the caller. blocking
+        """
+        digest = digest_of(img)
+        path = self.path(digest)
+        # the reference is taken before the write, so the blob can't be discarded while it's written,
+        # and the lock is only held to check and claim so other imports and releases aren't kept waiting
+        with self._lock:
+            while digest in self._writing:
+                self._written.wait()
+            self.refs[digest] += 1
+            if os.path.exists(path):
+                return digest
+            self._writing.add(digest)
+
+        try:
+            write_template(img, path, self.raw_store)
+        except BaseException:
+            with self._lock:
+                self._unref(digest)
+            raise
+        finally:
+            with self._lock:
+                self._writing.discard(digest)
+                self._written.notify_all()
+        return digest
+
+    def migrate(self, path):
+        """
+        copies a template stored the old way, as a per guild file, into the store and returns its hash.
+        the old file is left in place until retire is called, once the hash has been saved. blocking
+        """
+        from PIL import Image
+
+        with Image.open(path) as img:
+            return self.add(img.convert("RGBA"))
+
+    def retire(self, path):
+        """
+        deletes a migrated per guild template and its raw copy. blocking
+        """
+        if self.raw_store is not None:
+            self.raw_store.discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def rebuild(self, mappings):
+        """
+        recounts references from every guild's name -> hash mapping
+        """
+        refs = Counter()
+        for mapping in mappings:
+            refs.update(mapping.values())
+        with self._lock:
+            self.refs = refs
+
+    def release(self, digest):
+        """
+        drops one reference, returning True if that was the last one and the blob can be discarded
+        """
+        with self._lock:
+            return self._unref(digest)
+
+    def _unref(self, digest):
+        # called with the lock held
+        self.refs[digest] -= 1
+        if self.refs[digest] > 0:
+            return False
+        del self.refs[digest]
+        return True
+
+    def discard(self, digest):
+        """
+        deletes a blob and its raw copy, unless it was referenced again since it was released.
+        returns whether it was deleted. blocking
+        """
+        with self._lock:
+            if self.refs.get(digest):
+                return False
+            path = self.path(digest)
+            if self.raw_store is not None:
+                self.raw_store.discard(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return True
+
+    def sweep(self):
+        """
+        deletes blobs nothing refers to, left behind by an interrupted upload or import. blocking, returns how many went
+        """
+        removed = 0
+        for file_name in os.listdir(self.blob_dir):
+            digest, ext = os.path.splitext(file_name)
+            if ext == ".png" and self.discard(digest):
+                removed += 1
+        return removed
@@ -0,0 +1,69 @@
+# collects joins that arrive in quick succession so they can be welcomed together
+
+import asyncio
+import time
+from collections import deque
+
+
+class JoinBurstTracker:
+    """
+    tracks recent joins per guild. once a guild sees threshold joins inside its window,
+    further joins are held back and passed to flush(guild, members) as one batch when the window closes.
+    state is keyed by the guild object rather than its id, so a simulated guild sharing a real guild's id
+    never counts towards or collects the real guild's joins
+    """
+
+    def __init__(self, flush):
+        self.flush = flush
+        self._recent = {}
+        self._pending = {}
+        self._tasks = {}
+
+    def offer(self, member, window, threshold):
+        """
+        records a join. returns True if the member was held back for a combined welcome
+        """
+        if window <= 0 or threshold < 2:
+            return False
+
+        guild = member.guild
+        now = time.monotonic()
+        recent = self._recent.setdefault(guild, deque())
+        while recent and now - recent[0] > window:
+            recent.popleft()
+        recent.append(now)
+
+        # a burst is already being collected for this guild
+        if guild in self._pending:
+            self._pending[guild].append(member)
+            return True
+
+        if len(recent) < threshold:
+            return False
+
+        self._pending[guild] = [member]
+        self._tasks[guild] = asyncio.create_task(self._flush_later(guild, window))
+        return True
+
+    def pending(self, guild):
+        """
+        how many joins are being held back for the guild's next combined welcome
+        """
+        return len(self._pending.get(guild, ()))
+
+    async def _flush_later(self, guild, window):
+        try:
+            await asyncio.sleep(window)
+        finally:
+            members = self._pending.pop(guild, [])
+            self._tasks.pop(guild, None)
+
+        if members:
+            await self.flush(guild, members)
+
+    def cancel_all(self):
+        """
+        drops every burst still being collected
+        """
+        for task in list(self._tasks.values()):
+            task.cancel()
@@ -0,0 +1,117 @@
+# PIL drawing helpers for welcome images. everything here is blocking and runs on render workers
+
+import math
+
+# most avatars a single burst montage will draw
+MAX_MONTAGE_TILES = 48
+# the size templates are normally stored at
+TEMPLATE_SIZE = (1193, 671)
+
+
+def avatar_radius(coords, assets):
+    """
+    returns the avatar radius for a template's coords, falling back to the overlay size when none was saved
+    """
+    return coords[2] if len(coords) > 2 else assets.size
+
+
+def paste_avatar(base, avatar, coords, assets):
+    """
+    pastes the decoded avatar and its border onto base at coords = [x, y, radius]
+    """
+    radius = avatar_radius(coords, assets)
+    mask, border_overlay, border_overlay_mask = assets.overlays(radius)
+
+    if avatar.size != (radius, radius):
+        avatar = avatar.resize((radius, radius), 1)
+    base.paste(border_overlay, (coords[0], coords[1]), border_overlay_mask)
+    base.paste(avatar, (coords[0], coords[1]), mask)
+
+
+class CompiledTemplate:
+    """
+    a template with the avatar border already baked in, plus the mask and box the avatar gets pasted with.
+    rendering a welcome from it is a copy and a single paste
+    """
+
+    __slots__ = ("image", "mask", "box", "radius")
+
+    def __init__(self, image, mask, box, radius):
+        self.image = image
+        self.mask = mask
+        self.box = box
+        self.radius = radius
+
+    @property
+    def nbytes(self):
+        return self.image.width * self.image.height * len(self.image.getbands())
+
+    def render(self, avatar):
+        """
+        returns a new image of the template with the decoded avatar pasted in
+        """
+        if avatar.size != (self.radius, self.radius):
+            avatar = avatar.resize((self.radius, self.radius), 1)
+        base = self.image.copy()
+        base.paste(avatar, self.box, self.mask)
+        return base
+
+
+def scale_image(img, scale):
+    """
+    returns img shrunk by scale, or img itself at a scale of 1
+    """
+    if scale >= 1:
+        return img
+    from PIL import Image
+
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.BILINEAR)
+
+
+def compile_template(template, coords, assets):
+    """
+    bakes the border overlay into a copy of the template at coords = [x, y, radius]
+    """
+    radius = avatar_radius(coords, assets)
+    mask, border_overlay, border_overlay_mask = assets.overlays(radius)
+
+    baked = template.copy()
+    baked.paste(border_overlay, (coords[0], coords[1]), border_overlay_mask)
+    box = (coords[0], coords[1], coords[0] + radius, coords[1] + radius)
+    return CompiledTemplate(baked, mask, box, radius)
+
+
+def montage_layout(count, size=TEMPLATE_SIZE):
+    """
+    returns (cols, rows, cell, tile) for an even grid of count avatars over an image of the given size
+    """
+    width, height = size
+    cols = max(1, math.ceil(math.sqrt(count * width / height)))
+    rows = max(1, math.ceil(count / cols))
+    cell = min(width // cols, height // rows)
+    return cols, rows, cell, int(cell * 0.9)
+
+
+def tile_avatars(base, avatars, assets):
+    """
+    lays out the decoded avatars in an even grid over the whole of base.
+    anything past MAX_MONTAGE_TILES is left out
+    """
+    avatars = avatars[:MAX_MONTAGE_TILES]
+    if not avatars:
+        return
+
+    width, height = base.size
+    cols, rows, cell, size = montage_layout(len(avatars), base.size)
+
+    # center the grid on the template
+    left = (width - cols * cell) // 2
+    top = (height - rows * cell) // 2
+    offset = (cell - size) // 2
+
+    for index, avatar in enumerate(avatars):
+        row, col = divmod(index, cols)
+        x = left + col * cell + offset
+        y = top + row * cell + offset
+        paste_avatar(base, avatar, [x, y, size], assets)
@@ -0,0 +1,92 @@
+# thumbnail grids of a guild's random image pool, so the whole pool can be checked in a few small uploads
+
+import math
+from .encoding import OutputEncoding, encode_image
+from .lru import ByteLRU
+
+COLUMNS = 8
+ROWS = 6
+PAGE_SIZE = COLUMNS * ROWS
+THUMB_SIZE = (192, 108)
+LABEL_HEIGHT = 16
+PADDING = 4
+BACKGROUND = (47, 49, 54)
+LABEL_COLOUR = (220, 221, 222)
+MARKER_COLOUR = (237, 66, 69)
+SHEET_ENCODING = OutputEncoding("jpeg", 80)
+DEFAULT_PREVIEW_CACHE_MB = 8
+
+
+def page_count(entries):
+    return max(1, math.ceil(entries / PAGE_SIZE))
+
+
+def render_contact_sheet(entries, load, default_radius, first_index=1):
+    """
+    draws a grid of thumbnails for entries = [(name, path, coords)], each labelled with its number and name
+    and marked with where the avatar goes. load(path) returns the decoded template.
+    blocking, returns the encoded sheet
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    cols = min(COLUMNS, len(entries))
+    rows = math.ceil(len(entries) / cols)
+    cell_w = THUMB_SIZE[0] + PADDING * 2
+    cell_h = THUMB_SIZE[1] + LABEL_HEIGHT + PADDING * 2
+    sheet = Image.new("RGB", (cols * cell_w, rows * cell_h), BACKGROUND)
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+
+    for index, (name, path, coords) in enumerate(entries):
+        row, col = divmod(index, cols)
+        left = col * cell_w + PADDING
+        top = row * cell_h + PADDING
+
+        try:
+            template = load(path)
+        except OSError:
+            draw.rectangle(
+                (left, top, left + THUMB_SIZE[0], top + THUMB_SIZE[1]),
+                outline=MARKER_COLOUR,
+            )
+        else:
+            thumb = template.convert("RGB")
+            thumb.thumbnail(THUMB_SIZE, Image.BILINEAR)
+            sheet.paste(thumb, (left, top))
+
+            # outline where the avatar lands
+            scale = thumb.width / template.width
+            radius = coords[2] if len(coords) > 2 else default_radius
+            x, y = left + coords[0] * scale, top + coords[1] * scale
+            draw.ellipse(
+                (x, y, x + radius * scale, y + radius * scale),
+                outline=MARKER_COLOUR,
+                width=2,
+            )
+
+        label = f"{first_index + index}: {name.rsplit('.', 1)[0]}"
+        draw.text(
+            (left, top + THUMB_SIZE[1] + 2),
+            label[:32],
+            fill=LABEL_COLOUR,
+            font=font,
+        )
+
+    return encode_image(sheet, SHEET_ENCODING).getvalue()
+
+
+class ContactSheetCache:
+    """
+    encoded contact sheets keyed by guild, page and the pool's version, so a sheet is only drawn again after the pool changes
+    """
+
+    def __init__(self, budget_mb=DEFAULT_PREVIEW_CACHE_MB):
+        self._lru = ByteLRU(budget_mb)
+
+    def get(self, guild_id, version, page):
+        return self._lru.get((guild_id, version, page))
+
+    def put(self, guild_id, version, page, sheet):
+        # older versions of this guild's sheets can't be asked for again
+        self._lru.invalidate(lambda key: key[0] == guild_id and key[1] != version)
+        self._lru.put((guild_id, version, page), sheet, len(sheet))
@@ -0,0 +1,84 @@
+# encodes finished welcome images in the format each guild picked. blocking, runs on render workers
+
+import io
+from typing import NamedTuple
+
+# format name -> (PIL format, file extension)
+FORMATS = {
+    "png": ("PNG", "png"),
+    "webp": ("WEBP", "webp"),
+    "jpeg": ("JPEG", "jpg"),
+}
+
+# for png the quality is the zlib compression level (0-9), for the lossy formats it's 1-100
+DEFAULT_QUALITY = {"png": 6, "webp": 80, "jpeg": 85}
+QUALITY_RANGE = {"png": (0, 9), "webp": (1, 100), "jpeg": (1, 100)}
+
+# lossy formats step down by QUALITY_STEP until they fit the size budget or reach MIN_QUALITY
+QUALITY_STEP = 10
+MIN_QUALITY = 30
+
+
+class OutputEncoding(NamedTuple):
+    """
+    how a guild's welcome images are encoded. max_bytes of 0 means no size budget
+    """
+
+    format: str = "png"
+    quality: int = DEFAULT_QUALITY["png"]
+    max_bytes: int = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.output_format,
+            settings.output_quality,
+            settings.output_max_kb * 1024,
+        )
+
+    @property
+    def filename(self):
+        return "output." + FORMATS[self.format][1]
+
+
+def encode_image(img, encoding=OutputEncoding()):
+    """
+    encodes img into a rewound BytesIO that can be handed straight to discord.File
+    """
+    generated = io.BytesIO()
+    quality = encoding.quality
+
+    # jpeg has no alpha channel
+    if encoding.format == "jpeg" and img.mode != "RGB":
+        img = img.convert("RGB")
+
+    while True:
+        _save(img, generated, encoding.format, quality)
+        if not encoding.max_bytes or generated.tell() <= encoding.max_bytes:
+            break
+
+        if encoding.format == "png":
+            # the only thing left to try losslessly is the strongest compression
+            if quality >= 9:
+                break
+            quality = 9
+        elif quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - QUALITY_STEP)
+        else:
+            break
+
+        # reuse the buffer for the next attempt
+        generated.seek(0)
+        generated.truncate()
+
+    generated.seek(0)
+    return generated
+
+
+def _save(img, fp, fmt, quality):
+    if fmt == "png":
+        img.save(fp, format="PNG", compress_level=quality)
+    elif fmt == "webp":
+        img.save(fp, format="WEBP", quality=quality, method=2)
+    else:
+        img.save(fp, format="JPEG", quality=quality, optimize=False)
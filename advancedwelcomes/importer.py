@@ -0,0 +1,175 @@
+# imports a zip of templates plus a manifest of their avatar coords in one go
+
+import asyncio
+import csv
+import io
+import json
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from .uploads import InvalidUpload, MAX_UPLOAD_BYTES, prepare_template
+
+MAX_ARCHIVE_BYTES = 64 * 1024 * 1024
+MAX_ENTRIES = 500
+MANIFEST_NAMES = ("manifest.csv", "manifest.json")
+IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+_NAME = re.compile(r"^[\w\- ]+$")
+
+
+class ImportEntry(NamedTuple):
+    """
+    one template to import: its pool name, the archive member holding it, and its avatar coords
+    """
+
+    name: str
+    member: str
+    coords: list
+
+
+def _manifest_rows(archive):
+    for manifest in MANIFEST_NAMES:
+        try:
+            raw = archive.read(manifest).decode("utf-8-sig")
+        except KeyError:
+            continue
+        if manifest.endswith(".json"):
+            rows = json.loads(raw)
+            if isinstance(rows, dict):
+                rows = [
+                    {"name": name, "x": c[0], "y": c[1], "radius": c[2]}
+                    for name, c in rows.items()
+                ]
+            return rows
+        return list(csv.DictReader(io.StringIO(raw)))
+    raise InvalidUpload(
+        "The archive needs a manifest.csv or manifest.json with name, x, y and radius for each image."
+    )
+
+
+def read_manifest(archive):
+    """
+    returns ([ImportEntry], [(name, reason)]) for every row of the archive's manifest.
+    names can be given with or without their extension
+    """
+    members = {}
+    for info in archive.infolist():
+        if info.is_dir() or info.filename in MANIFEST_NAMES:
+            continue
+        path = pathlib.PurePosixPath(info.filename)
+        members.setdefault(path.name, info)
+        members.setdefault(path.stem, info)
+
+    try:
+        rows = _manifest_rows(archive)
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        raise InvalidUpload(f"The manifest couldn't be read: {e}") from e
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise InvalidUpload(
+            "The manifest couldn't be read: it needs to be a list of entries with name, x, y and radius."
+        )
+    if len(rows) > MAX_ENTRIES:
+        raise InvalidUpload(f"An archive can hold at most {MAX_ENTRIES} images.")
+
+    entries = []
+    failures = []
+    seen = set()
+    for row in rows:
+        name = str(row.get("name", "")).strip()
+        stem = pathlib.PurePosixPath(name).stem
+        info = members.get(name)
+        if not _NAME.match(stem):
+            failures.append((name, "names can only use letters, numbers, - and _"))
+        elif stem in seen:
+            failures.append((name, "listed more than once"))
+        elif info is None:
+            failures.append((name, "not in the archive"))
+        elif info.file_size > MAX_UPLOAD_BYTES:
+            failures.append((name, "too large"))
+        else:
+            try:
+                coords = [int(row["x"]), int(row["y"]), int(row["radius"])]
+            except (KeyError, TypeError, ValueError):
+                failures.append((name, "x, y and radius need to be whole numbers"))
+                continue
+            entries.append(ImportEntry(f"{stem}.png", info.filename, coords))
+        seen.add(stem)
+    return entries, failures
+
+
+def import_entry(archive_path, entry, directory, default_radius, commit):
+    """
+    extracts one entry from the archive into directory, normalizes it and returns what commit(image) returns. blocking
+    """
+    fd, extracted = tempfile.mkstemp(suffix=".upload", dir=directory)
+    try:
+        # every worker reads through its own handle
+        with zipfile.ZipFile(archive_path) as archive, os.fdopen(fd, "wb") as out:
+            with archive.open(entry.member) as source:
+                shutil.copyfileobj(source, out)
+        return commit(prepare_template(extracted, entry.coords, default_radius))
+    finally:
+        os.remove(extracted)
+
+
+async def import_archive(archive_path, directory, existing, default_radius, commit):
+    """
+    imports every template in the archive through commit, skipping names in existing.
+    images are extracted and normalized in parallel, using directory for scratch files.
+    returns ([(ImportEntry, commit result)], [(name, reason)])
+    """
+    loop = asyncio.get_running_loop()
+
+    def read():
+        with zipfile.ZipFile(archive_path) as archive:
+            return read_manifest(archive)
+
+    try:
+        entries, failures = await loop.run_in_executor(None, read)
+    except zipfile.BadZipFile as e:
+        raise InvalidUpload("That attachment isn't a zip archive.") from e
+
+    pending = []
+    for entry in entries:
+        if entry.name in existing:
+            failures.append((entry.name, "name already in use"))
+        else:
+            pending.append(entry)
+
+    pool = ThreadPoolExecutor(
+        max_workers=IMPORT_WORKERS, thread_name_prefix="advancedwelcomes-import"
+    )
+    try:
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool,
+                    import_entry,
+                    archive_path,
+                    entry,
+                    directory,
+                    default_radius,
+                    commit,
+                )
+                for entry in pending
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        # not waited for, so a cancelled import doesn't block the event loop until every queued entry is done
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    imported = []
+    for entry, result in zip(pending, results):
+        if isinstance(result, InvalidUpload):
+            failures.append((entry.name, str(result)))
+        elif isinstance(result, Exception):
+            failures.append((entry.name, f"couldn't be imported ({result})"))
+        else:
+            imported.append((entry, result))
+    return imported, failures
@@ -0,0 +1,266 @@
+# replays a raid of simulated joins through the real welcome path, to size the bot before a real one happens
+
+import asyncio
+import copy
+import itertools
+import os
+import re
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from .avatars import AvatarFetcher
+from .burst import JoinBurstTracker
+from .metrics import WelcomeMetrics
+from .outputcache import OutputCache
+
+# default avatars the discord cdn serves to anyone, used since simulated members have none of their own
+DEFAULT_AVATAR_URL = "https://cdn.discordapp.com/embed/avatars/{}.png"
+DEFAULT_AVATARS = 6
+
+# how often the queues and memory are sampled while the raid runs
+SAMPLE_INTERVAL = 0.1
+# the run ends once nothing has been sent and nothing is queued for this long
+SETTLE_SECONDS = 2.0
+MAX_RAID_JOINS = 5000
+
+_ids = itertools.count(1)
+_MENTION = re.compile(r"<@!?(\d+)>")
+
+
+class SimulatedAvatar:
+    """
+    stands in for a member's discord.Asset. every simulated member gets their own key,
+    so each join misses the avatar and output caches the way a raid of new accounts would
+    """
+
+    def __init__(self, key, index):
+        self.key = key
+        self.url = DEFAULT_AVATAR_URL.format(index % DEFAULT_AVATARS)
+
+    def is_animated(self):
+        return False
+
+    def with_static_format(self, fmt):
+        return self
+
+    def with_format(self, fmt):
+        return self
+
+    def with_size(self, size):
+        return self
+
+
+class SimulatedMember:
+    def __init__(self, member_id, guild):
+        self.id = member_id
+        self.guild = guild
+        self.mention = f"<@{member_id}>"
+        self.name = self.display_name = f"raider{member_id}"
+        self.display_avatar = SimulatedAvatar(f"loadtest-{member_id}", member_id)
+
+
+class SinkChannel:
+    """
+    takes the place of the welcome channel, recording when each welcome would have been posted instead of posting it
+    """
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        # (seconds since the raid started, content, whether it carried an image)
+        self.sends = []
+        self.started = time.perf_counter()
+        self.last_send = self.started
+
+    async def send(self, content=None, file=None, **kwargs):
+        self.last_send = time.perf_counter()
+        self.sends.append((self.last_send - self.started, content, file is not None))
+        if file is not None:
+            file.close()
+
+
+class SimulatedGuild:
+    """
+    has the id of a real guild, so its settings, pool and templates are used, but every welcome goes to the sink.
+    compares equal only to itself, so burst batches never mix its joins with the real guild's
+    """
+
+    def __init__(self, guild_id, name, member_count):
+        self.id = guild_id
+        self.name = name
+        self.member_count = member_count
+        # negative, so the sink never shares a send queue lane with a real channel
+        self.sink = SinkChannel(-guild_id)
+
+    def get_channel(self, channel_id):
+        return self.sink
+
+    def join(self):
+        self.member_count += 1
+        return SimulatedMember(next(_ids), self)
+
+
+def sandboxed(cog):
+    """
+    a copy of cog for one raid. it shares the settings, templates, render workers and send queue,
+    but has its own memory-only output cache, avatar cache, metrics and burst tracker,
+    so thousands of throwaway members neither evict real cached welcomes nor outlive the run
+    """
+    sandbox = copy.copy(cog)
+    sandbox.outputs = OutputCache(None, disk_mb=0)
+    sandbox.avatars = AvatarFetcher(cog.session, cog.renderer)
+    sandbox.metrics = WelcomeMetrics()
+    sandbox.bursts = JoinBurstTracker(sandbox.send_burst_welcome)
+    return sandbox
+
+
+def rss_mb():
+    """
+    the process's resident memory right now where the os tells us, else its peak
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def welcomed_at(members, joined, sends):
+    """
+    matches sends to the members they welcomed, by mention, falling back to the oldest member still waiting
+    for a send that mentions nobody (an image on its own). returns seconds from join to welcome per member welcomed
+    """
+    waiting = dict.fromkeys(member.id for member in members)
+    latencies = []
+    for sent_at, content, _ in sends:
+        mentioned = [int(found) for found in _MENTION.findall(content or "")]
+        found = [member_id for member_id in mentioned if member_id in waiting]
+        if not mentioned and waiting:
+            found = [next(iter(waiting))]
+        for member_id in found:
+            del waiting[member_id]
+            latencies.append(sent_at - joined[member_id])
+    return latencies
+
+
+async def run_raid(cog, guild, joins, rate, timeout=600):
+    """
+    dispatches joins simulated members to on_member_join of a sandboxed copy of cog at rate per second
+    (0 for all at once) and waits for their welcomes to reach guild's sink. returns a dict of what was measured
+    """
+    cog = sandboxed(cog)
+    sink = guild.sink
+    renderer = cog.renderer
+    outbound = cog.outbound
+    dropped, collapsed, stripped = (
+        outbound.dropped,
+        outbound.collapsed,
+        outbound.stripped,
+    )
+    rss_before = rss_mb()
+    samples = {"render_queue": [], "send_queue": [], "rss": []}
+
+    async def sample():
+        while True:
+            samples["render_queue"].append(renderer.in_flight + renderer.waiting)
+            samples["send_queue"].append(outbound.depth(sink.id))
+            samples["rss"].append(rss_mb())
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    sampler = asyncio.create_task(sample())
+    members = []
+    joined = {}
+    tasks = []
+    started = time.perf_counter()
+    sink.started = sink.last_send = started
+    try:
+        for index in range(joins):
+            if rate > 0:
+                delay = started + index / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            member = guild.join()
+            members.append(member)
+            joined[member.id] = time.perf_counter() - started
+            # discord.py dispatches each event as its own task
+            tasks.append(asyncio.create_task(cog.on_member_join(member)))
+        dispatched = time.perf_counter() - started
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = sum(isinstance(result, Exception) for result in results)
+
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            busy = (
+                cog.bursts.pending(guild)
+                or outbound.depth(sink.id)
+                or renderer.in_flight
+                or renderer.waiting
+            )
+            if not busy and time.perf_counter() - sink.last_send > SETTLE_SECONDS:
+                break
+            await asyncio.sleep(SAMPLE_INTERVAL)
+        finished = sink.last_send - started
+    finally:
+        sampler.cancel()
+        cog.bursts.cancel_all()
+
+    latencies = welcomed_at(members, joined, sink.sends)
+    return {
+        "joins": joins,
+        "rate": rate,
+        "dispatch_s": round(dispatched, 3),
+        "wall_s": round(finished, 3),
+        "messages": len(sink.sends),
+        "images": sum(image for _, _, image in sink.sends),
+        "welcomed": len(latencies),
+        "errors": errors,
+        "dropped": outbound.dropped - dropped,
+        "collapsed": outbound.collapsed - collapsed,
+        "stripped": outbound.stripped - stripped,
+        "throughput_per_s": round(len(latencies) / finished, 2) if finished else 0.0,
+        "latency_ms": {
+            f"p{pct}": round(percentile(latencies, pct) * 1000, 1)
+            for pct in (50, 95, 99, 100)
+        },
+        "max_render_queue": max(samples["render_queue"], default=0),
+        "max_send_queue": max(samples["send_queue"], default=0),
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "peak": round(max(samples["rss"], default=rss_before), 1),
+            "after": round(rss_mb(), 1),
+        },
+    }
+
+
+def format_report(report):
+    latency = report["latency_ms"]
+    rss = report["rss_mb"]
+    return (
+        f"{report['joins']} joins at {report['rate'] or 'max'}/s, dispatched in {report['dispatch_s']:.1f}s\n"
+        f"welcomed {report['welcomed']} in {report['messages']} messages ({report['images']} with images) "
+        f"over {report['wall_s']:.1f}s, {report['throughput_per_s']} members/s\n"
+        f"latency p50/p95/p99/max: {latency['p50']:.0f}/{latency['p95']:.0f}/{latency['p99']:.0f}/{latency['p100']:.0f} ms\n"
+        f"dropped: {report['dropped']}, collapsed: {report['collapsed']}, sent without image: {report['stripped']}, "
+        f"errors: {report['errors']}\n"
+        f"max render queue: {report['max_render_queue']}, max send queue: {report['max_send_queue']}\n"
+        f"rss before/peak/after: {rss['before']:.0f}/{rss['peak']:.0f}/{rss['after']:.0f} MB"
+    )
@@ -0,0 +1,106 @@
+# a thread-safe lru cache bounded by memory use rather than entry count
+
+import threading
+from collections import OrderedDict
+
+
+class ByteLRU:
+    """
+    lru cache where every entry carries its size in bytes.
+    least recently used entries are evicted once the total goes over the budget
+    """
+
+    def __init__(self, budget_mb):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.used = 0
+        # key -> (value, nbytes)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """
+        looks up an entry without touching its recency or the hit/miss counters
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+
+            # an entry bigger than the whole budget is never kept
+            if nbytes > self.budget:
+                return
+
+            self._entries[key] = (value, nbytes)
+            self.used += nbytes
+            self._evict()
+
+    def discard(self, key):
+        """
+        drops a single entry without counting it as an invalidation
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+
+    def invalidate(self, predicate):
+        """
+        drops every entry whose key matches predicate(key)
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.used -= self._entries.pop(key)[1]
+                self.invalidations += 1
+
+    def set_budget(self, budget_mb):
+        with self._lock:
+            self.budget = int(budget_mb * 1024 * 1024)
+            self._evict()
+
+    def _evict(self):
+        while self.used > self.budget and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.used -= nbytes
+            self.evictions += 1
+
+    def stats(self):
+        """
+        returns a snapshot of the cache counters
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "used_bytes": self.used,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def image_nbytes(img):
+    """
+    approximate memory held by a decoded PIL image
+    """
+    return img.width * img.height * len(img.getbands())
@@ -0,0 +1,93 @@
+# an in-memory manifest of every guild's random image pool, so joins never touch config or the disk to pick one
+
+import random
+
+
+class GuildPool:
+    """
+    the templates in one guild's random pool with their avatar coords and blob hashes, with O(1) add, remove and random pick
+    """
+
+    __slots__ = ("names", "coords", "digests", "version", "_index")
+
+    def __init__(self):
+        self.names = []
+        self.coords = {}
+        self.digests = {}
+        # bumped on every change, so anything built from the pool can tell it's stale
+        self.version = 0
+        self._index = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def add(self, name, coords, digest):
+        self.coords[name] = coords
+        self.digests[name] = digest
+        self.version += 1
+        if name not in self._index:
+            self._index[name] = len(self.names)
+            self.names.append(name)
+
+    def remove(self, name):
+        index = self._index.pop(name, None)
+        if index is None:
+            return
+        self.coords.pop(name, None)
+        self.digests.pop(name, None)
+        self.version += 1
+
+        # move the last name into the freed slot
+        last = self.names.pop()
+        if last != name:
+            self.names[index] = last
+            self._index[last] = index
+
+    def choose(self):
+        """
+        returns a random (name, coords), or None if the pool is empty
+        """
+        if not self.names:
+            return None
+        name = random.choice(self.names)
+        return name, self.coords[name]
+
+
+class TemplatePool:
+    """
+    builds each guild's pool once from its saved name -> blob mapping and keeps it in step with add_img/remove_img
+    """
+
+    def __init__(self):
+        self._pools = {}
+
+    async def get(self, guild_id, img_avatar_cfgs, img_blobs):
+        """
+        returns the guild's GuildPool, building it the first time it's asked for
+        """
+        pool = self._pools.get(guild_id)
+        if pool is not None:
+            return pool
+
+        pool = GuildPool()
+        for name in sorted(img_blobs):
+            coords = img_avatar_cfgs.get(name)
+            # a template without saved coords can't be rendered, so leave it out
+            if coords is not None:
+                pool.add(name, coords, img_blobs[name])
+
+        self._pools[guild_id] = pool
+        return pool
+
+    def add(self, guild_id, name, coords, digest):
+        pool = self._pools.get(guild_id)
+        if pool is not None:
+            pool.add(name, coords, digest)
+
+    def remove(self, guild_id, name):
+        pool = self._pools.get(guild_id)
+        if pool is not None:
+            pool.remove(name)
@@ -0,0 +1,163 @@
+# welcome message templates, parsed once into segments so a join only has to fill them in
+
+import functools
+import re
+
+PLACEHOLDERS = {
+    "USER": "mentions the new member",
+    "USERNAME": "the new member's name",
+    "SERVER": "the server's name",
+    "MEMBER_COUNT": "how many members the server has",
+    "JOIN_POSITION": "which member they are, e.g. 1234th",
+}
+
+_TOKEN = re.compile(r"\{([A-Z_]+)\}")
+
+# discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+# longest list of members a placeholder is filled with, so a burst's welcome still fits in one message
+LIST_LIMIT = 1500
+
+
+class InvalidPlaceholder(ValueError):
+    """
+    raised when a message uses a placeholder that doesn't exist
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.name = name
+
+
+class CompiledMessage:
+    """
+    a message split into literal text around its placeholders.
+    literals always has one more entry than keys
+    """
+
+    __slots__ = ("literals", "keys")
+
+    def __init__(self, literals, keys):
+        self.literals = literals
+        self.keys = keys
+
+    @property
+    def empty(self):
+        return not self.keys and not self.literals[0]
+
+    def render(self, values):
+        """
+        fills the placeholders from values (placeholder name -> text) in a single join
+        """
+        if not self.keys:
+            return self.literals[0]
+
+        parts = [self.literals[0]]
+        for key, literal in zip(self.keys, self.literals[1:]):
+            parts.append(values[key])
+            parts.append(literal)
+        return "".join(parts)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_message(text, strict=False):
+    """
+    parses text into a CompiledMessage. unknown placeholders raise InvalidPlaceholder when strict,
+    otherwise they're kept as literal text
+    """
+    literals = []
+    keys = []
+    pending = []
+    position = 0
+
+    for match in _TOKEN.finditer(text):
+        name = match.group(1)
+        pending.append(text[position : match.start()])
+        position = match.end()
+
+        if name in PLACEHOLDERS:
+            literals.append("".join(pending))
+            keys.append(name)
+            pending = []
+        elif strict:
+            raise InvalidPlaceholder(name)
+        else:
+            pending.append(match.group(0))
+
+    pending.append(text[position:])
+    literals.append("".join(pending))
+    return CompiledMessage(tuple(literals), tuple(keys))
+
+
+# what a burst is welcomed with when the guild has no welcome message of its own
+MENTIONS_ONLY = compile_message("{USER}")
+
+
+def render_welcome(message, mandatory, values):
+    """
+    fills in a compiled welcome message followed by the compiled mandatory fragment,
+    or just the fragment when there's no message or it's empty
+    """
+    fragment = mandatory.render(values)
+    if message is None or message.empty:
+        return fragment
+    return message.render(values) + ". " + fragment
+
+
+def ordinal(number):
+    if 10 <= number % 100 <= 20:
+        suffix = "th"
+    else:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+
+def limited_list(items, limit=LIST_LIMIT):
+    """
+    joins items with commas, ending with "and N more" instead of going past limit characters
+    """
+    shown = []
+    length = 0
+    for index, item in enumerate(items):
+        length += len(item) + 2
+        if length > limit:
+            shown.append(f"and {len(items) - index} more")
+            break
+        shown.append(item)
+    return ", ".join(shown)
+
+
+def clamp_message(text, limit=MESSAGE_LIMIT):
+    """
+    cuts text down to what discord will accept in one message
+    """
+    if len(text) <= limit:
+        return text
+    return text[: limit - 1] + "…"
+
+
+def welcome_values(members, guild):
+    """
+    the placeholder values for welcoming one or more members who just joined guild.
+    long lists of members are cut short with "and N more"
+    """
+    member_count = guild.member_count or 0
+    # someone who just joined is the newest member, so their position is the member count
+    first_position = member_count - len(members) + 1
+    return {
+        "USER": limited_list([member.mention for member in members]),
+        "USERNAME": limited_list([member.display_name for member in members]),
+        "SERVER": guild.name,
+        "MEMBER_COUNT": str(member_count),
+        "JOIN_POSITION": (
+            ordinal(member_count)
+            if len(members) == 1
+            else f"{ordinal(first_position)} to {ordinal(member_count)}"
+        ),
+    }
+
+
+def placeholder_help():
+    return "\n".join(
+        f"{{{name}}}: {description}" for name, description in PLACEHOLDERS.items()
+    )
@@ -0,0 +1,192 @@
+# per-guild timings and counters for the welcome pipeline, shown by [p]cw stats
+
+import json
+import logging
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+log = logging.getLogger("red.advancedwelcomes.metrics")
+
+# stages a welcome goes through, in order
+STAGES = ("config", "avatar", "queue", "render", "encode", "upload", "total")
+COUNTERS = (
+    "joins",
+    "coalesced",
+    "bursts",
+    "renders",
+    "animated",
+    "cache_hits",
+    "output_hits",
+    "failures",
+    "fallbacks",
+    "reduced_res",
+    "cheap_encode",
+    "text_only",
+)
+
+# samples kept per stage per guild
+WINDOW = 512
+
+
+class RollingHistogram:
+    """
+    keeps the last WINDOW samples of a stage and answers percentile queries over them
+    """
+
+    __slots__ = ("samples",)
+
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+class GuildMetrics:
+    __slots__ = ("counters", "stages")
+
+    def __init__(self):
+        self.counters = Counter()
+        self.stages = {stage: RollingHistogram() for stage in STAGES}
+
+
+class JoinTrace:
+    """
+    collects the stage timings and counters for one welcome, then hands them to WelcomeMetrics on finish
+    """
+
+    def __init__(self, metrics, guild_id, member_id=None):
+        self.metrics = metrics
+        self.guild_id = guild_id
+        self.member_id = member_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counts = Counter()
+        self.finished = False
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    def finish_when_sent(self, item):
+        """
+        finishes the trace once a queued message has gone out, timing the upload from now
+        """
+        queued = time.perf_counter()
+
+        def sent(_):
+            self.add("upload", time.perf_counter() - queued)
+            self.finish()
+
+        item.future.add_done_callback(sent)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.stages["total"] = time.perf_counter() - self.started
+        self.metrics.record(self)
+
+
+class _NullTrace:
+    """
+    stands in for a JoinTrace when nothing is being measured
+    """
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class WelcomeMetrics:
+    """
+    rolling per-guild histograms and counters for every welcome, plus an optional structured log line per join
+    """
+
+    def __init__(self):
+        self._guilds = {}
+        self.log_joins = False
+
+    def trace(self, guild_id, member_id=None):
+        return JoinTrace(self, guild_id, member_id)
+
+    def guild(self, guild_id):
+        metrics = self._guilds.get(guild_id)
+        if metrics is None:
+            metrics = self._guilds[guild_id] = GuildMetrics()
+        return metrics
+
+    def record(self, trace):
+        metrics = self.guild(trace.guild_id)
+        metrics.counters.update(trace.counts)
+        for stage, seconds in trace.stages.items():
+            histogram = metrics.stages.get(stage)
+            if histogram is None:
+                histogram = metrics.stages[stage] = RollingHistogram()
+            histogram.add(seconds)
+
+        if self.log_joins:
+            log.info(
+                json.dumps(
+                    {
+                        "guild": trace.guild_id,
+                        "member": trace.member_id,
+                        "ms": {
+                            stage: round(seconds * 1000, 2)
+                            for stage, seconds in trace.stages.items()
+                        },
+                        "counts": dict(trace.counts),
+                    }
+                )
+            )
+
+    def report(self, guild_id):
+        """
+        returns a plain text table of the guild's counters and stage percentiles
+        """
+        metrics = self.guild(guild_id)
+        lines = [
+            ", ".join(f"{name}: {metrics.counters[name]}" for name in COUNTERS),
+            "",
+            f"{'stage':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'n':>7}",
+        ]
+        for stage, histogram in metrics.stages.items():
+            if not len(histogram):
+                continue
+            lines.append(
+                f"{stage:<8}"
+                + "".join(
+                    f"{histogram.percentile(pct) * 1000:>10.1f}" for pct in (50, 95, 99)
+                )
+                + f"{len(histogram):>7}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,195 @@
+# keeps finished, encoded welcome images so a repeat join or a preview is served without rendering again
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from .lru import ByteLRU
+
+log = logging.getLogger("red.advancedwelcomes.outputcache")
+
+DEFAULT_OUTPUT_CACHE_MB = 16
+# the disk tier is off until the owner gives it a budget
+DEFAULT_OUTPUT_DISK_MB = 0
+
+
+def output_key(owner, name, version, coords, avatar_key, scale, encoding):
+    """
+    identifies one finished image: the template and the version of its file, where the avatar goes,
+    whose avatar, how far it was shrunk and how it was encoded. encoding is an OutputEncoding, or "gif" for animated renders
+    """
+    return (
+        owner,
+        name,
+        version,
+        tuple(coords),
+        avatar_key,
+        scale,
+        tuple(encoding) if isinstance(encoding, tuple) else encoding,
+    )
+
+
+def _template_tag(name):
+    return hashlib.sha1(str(name).encode()).hexdigest()[:16]
+
+
+def _file_name(key):
+    # prefixed by the template so every file of one template can be found without an index
+    return f"{_template_tag(key[1])}-{hashlib.sha1(repr(key).encode()).hexdigest()}"
+
+
+class OutputCache:
+    """
+    encoded welcome images in a memory lru, backed by an optional lru of files in disk_dir that survives restarts.
+    a template or coords change gives new keys, so old images are never served. invalidate frees them early
+    """
+
+    def __init__(
+        self,
+        disk_dir,
+        budget_mb=DEFAULT_OUTPUT_CACHE_MB,
+        disk_mb=DEFAULT_OUTPUT_DISK_MB,
+    ):
+        self.disk_dir = disk_dir
+        self._lru = ByteLRU(budget_mb)
+        self.disk_budget = int(disk_mb * 1024 * 1024)
+        self.disk_used = 0
+        self.disk_hits = 0
+        # file name -> size, oldest use first
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load_index(self):
+        """
+        reads which images are already on disk, oldest use first, and trims them to the disk budget. blocking
+        """
+        os.makedirs(self.disk_dir, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".staged"):
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime_ns, entry.name, stat.st_size))
+
+        with self._lock:
+            self._files = OrderedDict((name, size) for _, name, size in sorted(found))
+            self.disk_used = sum(self._files.values())
+            self._evict_files()
+
+    @property
+    def on_disk(self):
+        return self.disk_budget > 0
+
+    async def get(self, key):
+        """
+        returns the cached image as a rewound BytesIO, or None. memory is checked first, then disk
+        """
+        data = self._lru.get(key)
+        if data is None and self.on_disk:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, self._read, key)
+            if data is not None:
+                self._lru.put(key, data, len(data))
+        return None if data is None else io.BytesIO(data)
+
+    def put(self, key, generated):
+        """
+        caches a finished image given as a BytesIO, leaving it rewound. blocking when the disk tier is on,
+        so it runs on a render worker
+        """
+        data = generated.getvalue()
+        self._lru.put(key, data, len(data))
+        if self.on_disk and len(data) <= self.disk_budget:
+            try:
+                self._write(key, data)
+            except OSError:
+                log.warning("Couldn't write a cached welcome image", exc_info=True)
+        generated.seek(0)
+
+    def _read(self, key):
+        file_name = _file_name(key)
+        with self._lock:
+            if file_name not in self._files:
+                return None
+            self._files.move_to_end(file_name)
+        path = os.path.join(self.disk_dir, file_name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the mtime orders files by last use when the index is read again after a restart
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.disk_used -= self._files.pop(file_name, 0)
+            return None
+        self.disk_hits += 1
+        return data
+
+    def _write(self, key, data):
+        file_name = _file_name(key)
+        fd, staged = tempfile.mkstemp(suffix=".staged", dir=self.disk_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(data)
+            os.replace(staged, os.path.join(self.disk_dir, file_name))
+        except BaseException:
+            if os.path.exists(staged):
+                os.remove(staged)
+            raise
+
+        with self._lock:
+            self.disk_used += len(data) - self._files.pop(file_name, 0)
+            self._files[file_name] = len(data)
+            self._evict_files()
+
+    def _evict_files(self):
+        # called with the lock held
+        while self.disk_used > self.disk_budget and self._files:
+            file_name, size = self._files.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(os.path.join(self.disk_dir, file_name))
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, name):
+        """
+        drops every cached image made from the named template, in memory and on disk. blocking
+        """
+        self._lru.invalidate(lambda key: key[1] == name)
+        prefix = _template_tag(name) + "-"
+        with self._lock:
+            for file_name in [f for f in self._files if f.startswith(prefix)]:
+                self.disk_used -= self._files.pop(file_name)
+                try:
+                    os.remove(os.path.join(self.disk_dir, file_name))
+                except FileNotFoundError:
+                    pass
+
+    def set_budget(self, budget_mb, disk_mb):
+        """
+        changes both budgets, evicting straight away if needed. blocking
+        """
+        self._lru.set_budget(budget_mb)
+        with self._lock:
+            self.disk_budget = int(disk_mb * 1024 * 1024)
+            self._evict_files()
+
+    def stats(self):
+        """
+        returns a snapshot of the memory tier's counters plus the disk tier's use
+        """
+        stats = self._lru.stats()
+        with self._lock:
+            stats.update(
+                disk_files=len(self._files),
+                disk_used_bytes=self.disk_used,
+                disk_budget_bytes=self.disk_budget,
+                disk_hits=self.disk_hits,
+            )
+        return stats
@@ -0,0 +1,128 @@
+# uncompressed copies of welcome templates, memory mapped on load so a cold render skips the png decode
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+log = logging.getLogger("red.advancedwelcomes.rawstore")
+
+MAGIC = b"AWRGBA01"
+# magic, width, height, source mtime_ns, source size
+HEADER = struct.Struct("<8sIIqq")
+
+
+class RawTemplateStore:
+    """
+    keeps a raw RGBA copy of each template png in raw_dir, behind a small header recording the size and the png it came from.
+    loading maps the file and wraps it as an image without decoding, and the os page cache is shared by every worker.
+    a copy is stale, and gets rebuilt, as soon as its png's mtime or size changes
+    """
+
+    def __init__(self, raw_dir):
+        self.raw_dir = raw_dir
+        os.makedirs(raw_dir, exist_ok=True)
+
+    def path_for(self, template_path):
+        digest = hashlib.sha1(os.fsencode(os.path.abspath(template_path))).hexdigest()
+        return os.path.join(self.raw_dir, digest + ".rgba")
+
+    def load(self, template_path):
+        """
+        returns the template at template_path as a read-only RGBA image, writing its raw copy first if needed. blocking
+        """
+        source = os.stat(template_path)
+        img = self.open(template_path, source)
+        if img is None:
+            from PIL import Image
+
+            with Image.open(template_path) as decoded:
+                img = decoded.convert("RGBA")
+            try:
+                self.write(img, template_path, source)
+            except OSError:
+                log.warning(
+                    "Couldn't store a raw copy of %s", template_path, exc_info=True
+                )
+        return img
+
+    def open(self, template_path, source=None):
+        """
+        maps the raw copy of template_path, returning None if there isn't an up to date one
+        """
+        source = source or os.stat(template_path)
+        try:
+            with open(self.path_for(template_path), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file can't be mapped
+            return None
+
+        if len(mapped) < HEADER.size:
+            mapped.close()
+            return None
+        magic, width, height, mtime, size = HEADER.unpack_from(mapped)
+        if (
+            magic != MAGIC
+            or mtime != source.st_mtime_ns
+            or size != source.st_size
+            or len(mapped) != HEADER.size + width * height * 4
+        ):
+            # closed straight away, so a stale copy doesn't stay mapped and block its own rebuild on windows
+            mapped.close()
+            return None
+
+        from PIL import Image
+
+        # the image keeps the map alive, the pixels are paged in as they're read
+        return Image.frombuffer(
+            "RGBA",
+            (width, height),
+            memoryview(mapped)[HEADER.size :],
+            "raw",
+            "RGBA",
+            0,
+            1,
+        )
+
+    def write(self, img, template_path, source=None):
+        """
+        stores img as the raw copy of template_path, replacing any older copy atomically.
+        on windows an older copy that's still mapped can't be replaced, so it's left as it is.
+        it no longer matches its png, so loads decode the png instead until one of them can rebuild it
+        """
+        source = source or os.stat(template_path)
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+
+        fd, staged = tempfile.mkstemp(suffix=".staged", dir=self.raw_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(
+                    HEADER.pack(
+                        MAGIC, img.width, img.height, source.st_mtime_ns, source.st_size
+                    )
+                )
+                out.write(img.tobytes())
+            os.replace(staged, self.path_for(template_path))
+        except PermissionError:
+            os.remove(staged)
+            log.warning(
+                "The raw copy of %s is still in use, it'll be rebuilt later",
+                template_path,
+            )
+        except BaseException:
+            if os.path.exists(staged):
+                os.remove(staged)
+            raise
+
+    def discard(self, template_path):
+        try:
+            os.remove(self.path_for(template_path))
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # still mapped by a render on windows. left behind, it's stale once its png is gone
+            log.warning("Couldn't delete the raw copy of %s", template_path)
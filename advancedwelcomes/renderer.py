@@ -0,0 +1,101 @@
+# runs the blocking PIL work for welcome images on worker threads, off the event loop
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE = 16
+# weight of the newest render in the running average render time
+SERVICE_SMOOTHING = 0.2
+
+
+class RenderExecutor:
+    """
+    thread pool for image rendering with a bounded queue.
+    at most workers + max_queue renders are handed to the pool at once, further callers wait their turn
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = self._make_pool(workers)
+        self._slots = asyncio.Semaphore(workers + max_queue)
+        self.in_flight = 0
+        # callers waiting for a slot in the bounded queue
+        self.waiting = 0
+        # running average of seconds a render spends on a worker
+        self.service_time = 0.0
+
+    def _make_pool(self, workers):
+        return ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="advancedwelcomes-render"
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """
+        runs func(*args, **kwargs) on a render worker and returns its result
+        """
+        result, _ = await self.run_timed(func, *args, **kwargs)
+        return result
+
+    async def run_timed(self, func, *args, **kwargs):
+        """
+        like run, but returns (result, seconds spent waiting for a worker)
+        """
+        submitted = time.perf_counter()
+        started = None
+
+        def timed():
+            nonlocal started
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._observe(time.perf_counter() - started)
+
+        slots = self._slots
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._pool, timed)
+        finally:
+            self.in_flight -= 1
+            slots.release()
+        return result, started - submitted
+
+    def _observe(self, seconds):
+        # called from worker threads, a lost update only nudges the average
+        if self.service_time:
+            self.service_time += SERVICE_SMOOTHING * (seconds - self.service_time)
+        else:
+            self.service_time = seconds
+
+    def estimated_wait(self):
+        """
+        roughly how long a render submitted now would wait for a worker, from the renders
+        ahead of it and the average render time
+        """
+        ahead = self.in_flight + self.waiting - self.workers + 1
+        if ahead <= 0:
+            return 0.0
+        return ahead / self.workers * self.service_time
+
+    def resize(self, workers, max_queue):
+        """
+        swaps in a pool with the new sizes. renders already running finish on the old pool
+        """
+        old_pool = self._pool
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = self._make_pool(workers)
+        self._slots = asyncio.Semaphore(workers + max_queue)
+        old_pool.shutdown(wait=False)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
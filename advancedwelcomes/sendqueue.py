@@ -0,0 +1,270 @@
+# queues outgoing welcomes per channel so they go out in join order at a pace discord will accept
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import NamedTuple
+from .messages import MESSAGE_LIMIT
+
+log = logging.getLogger("red.advancedwelcomes.sendqueue")
+
+# discord lets a bot post about 5 messages per 5 seconds in one channel
+BUCKET_SIZE = 5
+BUCKET_PERIOD = 5.0
+
+POLICIES = ("collapse", "drop")
+
+
+class SendLimits(NamedTuple):
+    """
+    how much backlog a guild's welcome channel may build up, and what to do past it
+    """
+
+    max_depth: int = 20
+    policy: str = "collapse"
+    latency_budget: float = 30.0
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.send_queue_depth,
+            settings.send_queue_policy,
+            settings.send_latency_budget,
+        )
+
+
+class OutboundWelcome:
+    """
+    one queued message. future resolves to the sent discord.Message, or None if it was dropped or merged.
+    fallback is the text it's sent as if collapse has to leave its image out.
+    until it's filled, it holds its place in the lane while the welcome is still being made
+    """
+
+    __slots__ = (
+        "channel_id",
+        "content",
+        "file",
+        "fallback",
+        "filled",
+        "queued_at",
+        "future",
+    )
+
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+        self.content = None
+        self.file = None
+        self.fallback = None
+        self.filled = False
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def strip_file(self):
+        """
+        leaves the image out, so the welcome can be merged with the text ones around it
+        """
+        self.file.close()
+        self.file = None
+        if not self.content:
+            self.content = self.fallback
+
+    def settle(self, result):
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+class _ChannelLane:
+    __slots__ = ("channel", "items", "limits", "tokens", "refilled", "task", "filled")
+
+    def __init__(self, channel, limits):
+        self.channel = channel
+        self.items = deque()
+        # set whenever a reserved welcome is filled, to wake the drain waiting on it
+        self.filled = asyncio.Event()
+        self.limits = limits
+        self.tokens = BUCKET_SIZE
+        self.refilled = time.monotonic()
+        self.task = None
+
+    async def pace(self):
+        """
+        waits for a token from the channel's bucket
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                BUCKET_SIZE,
+                self.tokens + (now - self.refilled) * BUCKET_SIZE / BUCKET_PERIOD,
+            )
+            self.refilled = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * BUCKET_PERIOD / BUCKET_SIZE)
+
+
+class ChannelSendQueue:
+    """
+    one ordered lane per channel, drained by a task that paces sends to the channel's rate limit.
+    once a lane is deeper than its max depth or its oldest message has waited past the latency budget,
+    the policy kicks in: collapse merges queued text-only welcomes into one message, leaving out the images
+    of the oldest welcomes if that's what it takes, while drop discards the oldest
+    """
+
+    def __init__(self):
+        self._lanes = {}
+        self.sent = 0
+        self.dropped = 0
+        self.collapsed = 0
+        self.stripped = 0
+
+    def enqueue(
+        self, channel, content=None, file=None, limits=SendLimits(), fallback=None
+    ):
+        """
+        queues a message for channel and returns its OutboundWelcome.
+        a message with a file and no content needs a fallback, for when collapse sends it without the file
+        """
+        item = self.reserve(channel, limits)
+        self.fill(item, content, file, fallback)
+        return item
+
+    def reserve(self, channel, limits=SendLimits()):
+        """
+        takes the next place in channel's lane for a welcome that's still being made, and returns its OutboundWelcome.
+        messages queued after it wait for it to be filled, so welcomes go out in join order
+        """
+        lane = self._lanes.get(channel.id)
+        if lane is None:
+            lane = _ChannelLane(channel, limits)
+            self._lanes[channel.id] = lane
+        lane.limits = limits
+
+        item = OutboundWelcome(channel.id)
+        lane.items.append(item)
+        self._enforce(lane)
+
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._drain(channel.id, lane))
+        return item
+
+    def fill(self, item, content=None, file=None, fallback=None):
+        """
+        gives a reserved welcome what to send. filled with nothing, its place is given up
+        """
+        lane = self._lanes.get(item.channel_id)
+        if item.future.done() or lane is None:
+            # dropped, or the queue was closed, while the welcome was being made
+            if file is not None:
+                file.close()
+            return
+
+        if content is None and file is None:
+            lane.items.remove(item)
+            item.settle(None)
+        else:
+            item.content = content
+            item.file = file
+            item.fallback = fallback
+            item.filled = True
+            self._enforce(lane)
+        lane.filled.set()
+
+    def depth(self, channel_id=None):
+        """
+        how many messages are waiting in one channel, or across all of them
+        """
+        if channel_id is not None:
+            lane = self._lanes.get(channel_id)
+            return len(lane.items) if lane else 0
+        return sum(len(lane.items) for lane in self._lanes.values())
+
+    def _over_budget(self, lane):
+        if len(lane.items) > lane.limits.max_depth:
+            return True
+        waited = time.monotonic() - lane.items[0].queued_at
+        return waited > lane.limits.latency_budget
+
+    def _enforce(self, lane):
+        if not lane.items or not self._over_budget(lane):
+            return
+
+        if lane.limits.policy == "collapse":
+            self._collapse(lane)
+            # nothing is dropped under collapse. images go instead, oldest first, so their text can be merged
+            for item in list(lane.items):
+                if not self._over_budget(lane):
+                    break
+                if item.file is not None and (item.content or item.fallback):
+                    item.strip_file()
+                    self.stripped += 1
+                    self._collapse(lane)
+            return
+
+        # whatever is over the limits gets dropped, oldest first
+        while lane.items and self._over_budget(lane):
+            lane.items.popleft().settle(None)
+            self.dropped += 1
+
+    def _collapse(self, lane):
+        """
+        merges runs of queued text-only welcomes into as few messages as fit discord's length limit
+        """
+        merged = deque()
+        for item in lane.items:
+            previous = merged[-1] if merged else None
+            if (
+                item.filled
+                and item.file is None
+                and previous is not None
+                and previous.filled
+                and previous.file is None
+                and item.content
+                and len(previous.content) + len(item.content) + 1 <= MESSAGE_LIMIT
+            ):
+                previous.content += "\n" + item.content
+                # the merged message counts from when its newest part was queued
+                previous.queued_at = item.queued_at
+                item.settle(None)
+                self.collapsed += 1
+            else:
+                merged.append(item)
+        lane.items = merged
+
+    async def _drain(self, channel_id, lane):
+        try:
+            while lane.items:
+                self._enforce(lane)
+                if not lane.items:
+                    break
+                if not lane.items[0].filled:
+                    # the next member's welcome is still being made, the ones after it wait their turn
+                    lane.filled.clear()
+                    await lane.filled.wait()
+                    continue
+
+                item = lane.items.popleft()
+                await lane.pace()
+                try:
+                    message = await lane.channel.send(item.content, file=item.file)
+                    self.sent += 1
+                    item.settle(message)
+                except Exception:
+                    log.exception("Failed to send welcome in channel %s", channel_id)
+                    item.settle(None)
+        finally:
+            lane.task = None
+            if not lane.items:
+                self._lanes.pop(channel_id, None)
+
+    def close(self):
+        """
+        stops every lane, discarding anything still queued
+        """
+        for lane in list(self._lanes.values()):
+            if lane.task is not None:
+                lane.task.cancel()
+            for item in lane.items:
+                item.settle(None)
+        self._lanes.clear()
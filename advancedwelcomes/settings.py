@@ -0,0 +1,112 @@
+# an in-memory snapshot of each guild's welcome settings, so joins don't hit config repeatedly
+
+import asyncio
+from dataclasses import dataclass
+from .messages import CompiledMessage, compile_message
+
+
+@dataclass(frozen=True)
+class GuildSettings:
+    """
+    read-only view of one guild's welcome config, loaded with a single config read.
+    the welcome messages and mandatory fragment are compiled once here, so joins only fill them in
+    """
+
+    welcome_msg_channel: int
+    toggle_msg: bool
+    toggle_img: bool
+    randomise_msg: bool
+    randomise_img: bool
+    def_welcome_msg: str
+    mandatory_msg_frag: str
+    message_pool: tuple
+    img_avatar_cfgs: dict
+    img_blobs: dict
+    burst_window: int
+    burst_threshold: int
+    output_format: str
+    output_quality: int
+    output_max_kb: int
+    send_queue_depth: int
+    send_queue_policy: str
+    send_latency_budget: int
+    animated_avatars: bool
+    render_slo: int
+    welcome_message: CompiledMessage
+    pool_messages: tuple
+    mandatory_message: CompiledMessage
+
+    @classmethod
+    def from_config(cls, raw):
+        return cls(
+            welcome_msg_channel=raw["welcome_msg_channel"],
+            toggle_msg=raw["toggle_msg"],
+            toggle_img=raw["toggle_img"],
+            randomise_msg=raw["randomise_msg"],
+            randomise_img=raw["randomise_img"],
+            def_welcome_msg=raw["def_welcome_msg"],
+            mandatory_msg_frag=raw["mandatory_msg_frag"],
+            message_pool=tuple(raw["message_pool"]),
+            img_avatar_cfgs=raw["img_avatar_cfgs"],
+            img_blobs=raw["img_blobs"],
+            burst_window=raw["burst_window"],
+            burst_threshold=raw["burst_threshold"],
+            output_format=raw["output_format"],
+            output_quality=raw["output_quality"],
+            output_max_kb=raw["output_max_kb"],
+            send_queue_depth=raw["send_queue_depth"],
+            send_queue_policy=raw["send_queue_policy"],
+            send_latency_budget=raw["send_latency_budget"],
+            animated_avatars=raw["animated_avatars"],
+            render_slo=raw["render_slo"],
+            welcome_message=compile_message(str(raw["def_welcome_msg"])),
+            pool_messages=tuple(
+                compile_message(str(message)) for message in raw["message_pool"]
+            ),
+            mandatory_message=compile_message(str(raw["mandatory_msg_frag"])),
+        )
+
+    def channel(self, guild):
+        """
+        resolves the welcome channel by id
+        """
+        return guild.get_channel(self.welcome_msg_channel)
+
+
+class GuildSettingsCache:
+    """
+    caches a GuildSettings per guild. concurrent joins for an uncached guild share one config read
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._snapshots = {}
+        self._loading = {}
+        # bumped on every invalidation so a read that raced a setter is never cached
+        self._generations = {}
+
+    async def get(self, guild):
+        snapshot = self._snapshots.get(guild.id)
+        if snapshot is not None:
+            return snapshot
+
+        loading = self._loading.get(guild.id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(guild))
+            self._loading[guild.id] = loading
+        return await asyncio.shield(loading)
+
+    async def _load(self, guild):
+        generation = self._generations.get(guild.id, 0)
+        try:
+            snapshot = GuildSettings.from_config(await self.config.guild(guild).all())
+            if self._generations.get(guild.id, 0) == generation:
+                self._snapshots[guild.id] = snapshot
+            return snapshot
+        finally:
+            self._loading.pop(guild.id, None)
+
+    def invalidate(self, guild_id):
+        self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+        self._snapshots.pop(guild_id, None)
+        self._loading.pop(guild_id, None)
@@ -0,0 +1,106 @@
+# keeps decoded welcome templates in memory so joins don't re-decode the same png
+
+import os
+from .lru import ByteLRU, image_nbytes
+from .compositing import compile_template
+
+DEFAULT_BUDGET_MB = 64
+
+
+def decode_template(path):
+    """
+    decodes a template file fully into an RGBA image and closes the file
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.convert("RGBA")
+
+
+class TemplateCache:
+    """
+    bounded lru cache of decoded RGBA welcome templates, keyed by guild id and template name.
+    entries are dropped when their file's mtime changes, when invalidated explicitly,
+    or when the cache grows past its memory budget.
+    with a raw_store, cache misses map the template's raw copy instead of decoding the png
+    """
+
+    def __init__(self, budget_mb=DEFAULT_BUDGET_MB, raw_store=None):
+        self.raw_store = raw_store
+        # entries are keyed (guild_id, name, kind, mtime, ...) so a changed file can never be served stale
+        self._lru = ByteLRU(budget_mb)
+        # (guild_id, name, kind) -> the key of the version currently cached
+        self._current = {}
+
+    def get(self, guild_id, name, path):
+        """
+        returns the decoded template stored at path. the image is shared, copy it before drawing on it
+        """
+        key = (guild_id, name, "raw", os.stat(path).st_mtime_ns)
+        decoded = self._lru.get(key)
+        if decoded is None:
+            decoded = self._load(path)
+            self._store(key, decoded, image_nbytes(decoded))
+        return decoded
+
+    def compiled(self, guild_id, name, path, coords, assets, trace=None):
+        """
+        returns the template at path with its border baked in for the given avatar coords.
+        changing the file or the coords builds a new one
+        """
+        mtime = os.stat(path).st_mtime_ns
+        key = (guild_id, name, "compiled", mtime, tuple(coords))
+        compiled = self._lru.get(key)
+        if compiled is not None and trace is not None:
+            trace.count("cache_hits")
+        if compiled is None:
+            decoded = self._lru.peek((guild_id, name, "raw", mtime))
+            if decoded is None:
+                decoded = self._load(path)
+            compiled = compile_template(decoded, coords, assets)
+            self._store(key, compiled, compiled.nbytes)
+        return compiled
+
+    def _load(self, path):
+        if self.raw_store is not None:
+            return self.raw_store.load(path)
+        return decode_template(path)
+
+    def _store(self, key, value, nbytes):
+        """
+        caches value, replacing whatever older version of the same template and kind was cached
+        """
+        slot = key[:3]
+        old_key = self._current.get(slot)
+        if old_key is not None and old_key != key:
+            self._lru.discard(old_key)
+
+        self._current[slot] = key
+        self._lru.put(key, value, nbytes)
+
+    def invalidate(self, guild_id=None, name=None):
+        """
+        drops every cached template matching the given guild id and/or name
+        """
+
+        def matches(key):
+            return (guild_id is None or key[0] == guild_id) and (
+                name is None or key[1] == name
+            )
+
+        for slot in list(self._current):
+            if matches(slot):
+                self._current.pop(slot, None)
+        self._lru.invalidate(matches)
+
+    def set_budget(self, budget_mb):
+        """
+        changes the memory budget, evicting entries straight away if needed
+        """
+        self._lru.set_budget(budget_mb)
+
+    def stats(self):
+        """
+        returns a snapshot of the cache counters
+        """
+        return self._lru.stats()
@@ -0,0 +1,147 @@
+# takes uploaded welcome templates from an attachment to a checked, normalized png on disk without blocking the event loop
+
+import os
+import tempfile
+import aiohttp
+
+# biggest attachment accepted as a template
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+# biggest image (in pixels) accepted as a template, checked before anything is decoded
+MAX_PIXELS = 4096 * 4096
+CHUNK_SIZE = 64 * 1024
+UPLOAD_TIMEOUT = 30
+# renders read the raw copy rather than the png, so stored pngs favour a fast save over size
+STORED_PNG_LEVEL = 1
+
+
+class InvalidUpload(ValueError):
+    """
+    raised when an uploaded template can't be used. the message is meant for the person who uploaded it
+    """
+
+
+def validate_placement(size, coords, default_radius):
+    """
+    checks that the avatar box at coords = [x, y, radius] fits inside an image of the given size
+    """
+    width, height = size
+    radius = coords[2] if len(coords) > 2 else default_radius
+    if radius <= 0:
+        raise InvalidUpload("The avatar radius has to be bigger than 0.")
+    if coords[0] < 0 or coords[1] < 0:
+        raise InvalidUpload("The avatar coordinates can't be negative.")
+    if coords[0] + radius > width or coords[1] + radius > height:
+        raise InvalidUpload(
+            f"An avatar of radius {radius} at x:{coords[0]} y:{coords[1]} doesn't fit inside "
+            f"the {width}x{height} image. Pick coordinates so it ends before the image edge."
+        )
+
+
+def prepare_template(upload_path, coords, default_radius, size=None):
+    """
+    decodes an uploaded file, converts it to RGBA, resizes it to size if given and checks the avatar fits.
+    blocking, returns the normalized image
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(upload_path) as img:
+            if img.width * img.height > MAX_PIXELS:
+                raise InvalidUpload(
+                    f"That image is {img.width}x{img.height}, which is too large to use."
+                )
+            normalized = img.convert("RGBA")
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        if isinstance(e, InvalidUpload):
+            raise
+        raise InvalidUpload("That attachment isn't an image that can be read.") from e
+
+    if size is not None and normalized.size != size:
+        normalized = normalized.resize(size, Image.BILINEAR)
+    validate_placement(normalized.size, coords, default_radius)
+    return normalized
+
+
+def write_template(img, destination, raw_store=None):
+    """
+    writes img as a png next to destination and renames it over it, so readers never see a partial file,
+    then writes its raw copy to raw_store. blocking
+    """
+    fd, staged = tempfile.mkstemp(suffix=".staged", dir=os.path.dirname(destination))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            img.save(out, format="PNG", dpi=(72, 72), compress_level=STORED_PNG_LEVEL)
+        os.replace(staged, destination)
+    except BaseException:
+        if os.path.exists(staged):
+            os.remove(staged)
+        raise
+
+    if raw_store is not None:
+        raw_store.write(img, destination)
+
+
+class TemplateUploader:
+    """
+    streams attachments to a temp file through the shared http session, then normalizes them on a render worker
+    """
+
+    def __init__(self, session, renderer):
+        self.session = session
+        self.renderer = renderer
+        self.timeout = aiohttp.ClientTimeout(total=UPLOAD_TIMEOUT)
+
+    @staticmethod
+    def check_attachments(attachments, max_bytes=MAX_UPLOAD_BYTES):
+        """
+        returns the single attached file, or raises InvalidUpload before any prompts are sent
+        """
+        if len(attachments) != 1:
+            raise InvalidUpload(
+                "You need to attach exactly 1 image in the message that uses this command"
+            )
+        attachment = attachments[0]
+        if attachment.size > max_bytes:
+            raise InvalidUpload(
+                f"That file is too large, the limit is {max_bytes // (1024 * 1024)} MB."
+            )
+        return attachment
+
+    async def install(
+        self, attachment, directory, commit, coords, default_radius, size=None
+    ):
+        """
+        downloads the attachment into directory, checks and normalizes it, then hands the image to commit
+        on the same worker and returns what commit returns
+        """
+        upload_path = await self.download(attachment, directory)
+
+        def normalize():
+            return commit(prepare_template(upload_path, coords, default_radius, size))
+
+        try:
+            return await self.renderer.run(normalize)
+        finally:
+            os.remove(upload_path)
+
+    async def download(self, attachment, directory, max_bytes=MAX_UPLOAD_BYTES):
+        """
+        streams the attachment into a temp file in directory and returns its path
+        """
+        fd, upload_path = tempfile.mkstemp(suffix=".upload", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                async with self.session.get(
+                    attachment.url, timeout=self.timeout
+                ) as response:
+                    response.raise_for_status()
+                    received = 0
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        received += len(chunk)
+                        if received > max_bytes:
+                            raise InvalidUpload("That file is too large.")
+                        out.write(chunk)
+        except BaseException:
+            os.remove(upload_path)
+            raise
+        return upload_path
@@ -0,0 +1,46 @@
+# tracks the background cache warm-up that runs when the cog loads
+
+import time
+
+# warm-up stops once the template cache is this full, leaving the rest for live joins
+WARM_BUDGET_SHARE = 0.9
+
+
+class WarmupProgress:
+    """
+    how far the load-time warm-up has got, shown by [p]cw cfg cachestats
+    """
+
+    def __init__(self):
+        self.guilds_total = 0
+        self.guilds_done = 0
+        self.templates = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self.stopped = None
+
+    def start(self, guilds_total):
+        self.guilds_total = guilds_total
+        self.started = time.perf_counter()
+
+    def finish(self, stopped=None):
+        self.finished = time.perf_counter()
+        self.stopped = stopped
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self):
+        if self.started is None:
+            return "Warm-up: not started"
+        state = "done" if self.finished is not None else "running"
+        if self.stopped:
+            state = f"stopped early ({self.stopped})"
+        return (
+            f"Warm-up: {state}, {self.guilds_done}/{self.guilds_total} guilds, "
+            f"{self.templates} templates, {self.failed} failed, {self.elapsed:.1f}s"
+        )
@@ -0,0 +1,89 @@
+"""
+headless raid simulation for advancedwelcomes, the same run as [p]cw cfg raidtest without a discord connection.
+
+loads the cog against a Red instance's saved data, then replays simulated joins for one of its guilds through
+on_member_join, recording the welcomes instead of posting them, and reports latency, throughput, queue depth and memory.
+
+    python benchmarks/raid_simulation.py --instance mybot --guild 123456789 --joins 500 --rate 50 --output raid.json
+
+needs Red installed and network access to the discord cdn for the default avatars.
+stop the bot first, the instance's config shouldn't be used by two processes at once
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+
+
+class HeadlessBot:
+    """the parts of Red the cog uses outside of commands"""
+
+    def get_guild(self, guild_id):
+        # no guilds are connected, so the load-time warm-up has nothing to do
+        return None
+
+    async def wait_until_red_ready(self):
+        pass
+
+
+async def simulate(args):
+    from redbot.core import data_manager, _drivers
+
+    data_manager.load_basic_configuration(args.instance)
+    driver_cls = _drivers.get_driver_class()
+    await driver_cls.initialize(**data_manager.storage_details())
+    try:
+        sys.path.insert(0, str(REPO))
+        from advancedwelcomes import AdvancedWelcomes, IMPORT_SECONDS
+        from advancedwelcomes.loadtest import SimulatedGuild, run_raid, format_report
+
+        cog = AdvancedWelcomes(HeadlessBot(), IMPORT_SECONDS)
+        await cog.cog_load()
+        try:
+            guild = SimulatedGuild(args.guild, args.name, args.members)
+            report = await run_raid(cog, guild, args.joins, args.rate, args.timeout)
+        finally:
+            await cog.cog_unload()
+    finally:
+        await driver_cls.teardown()
+
+    print(format_report(report))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--instance", required=True, help="name of the Red instance")
+    parser.add_argument(
+        "--guild", type=int, required=True, help="id of the guild whose settings to use"
+    )
+    parser.add_argument("--joins", type=int, default=200)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="joins per second (0 = all at once)"
+    )
+    parser.add_argument(
+        "--members", type=int, default=1000, help="member count before the raid"
+    )
+    parser.add_argument("--name", default="Load test", help="server name placeholder")
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="seconds to wait for the welcomes"
+    )
+    parser.add_argument("--output", type=pathlib.Path, help="write results json here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(simulate(args))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"results written to {args.output}")
+    return 0 if report["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
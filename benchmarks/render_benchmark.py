@@ -0,0 +1,562 @@
+"""
+offline benchmark for the advancedwelcomes image pipeline.
+
+runs the same avatar fetch -> decode -> composite -> encode path the cog uses on a join,
+with stub members and guilds and a local avatar corpus instead of discord, and reports
+latency percentiles, encode time, peak RSS and throughput at 1..N concurrent renders.
+
+    python benchmarks/render_benchmark.py --joins 200 --concurrency 1 2 4 8 --output run.json
+    python benchmarks/render_benchmark.py --baseline run.json
+
+needs Pillow and aiohttp (both come with Red), but not Red or discord.py
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+COG_DIR = REPO / "advancedwelcomes"
+
+# how much slower a percentile may get against the baseline before it counts as a regression
+REGRESSION_TOLERANCE = 0.10
+
+
+def load_cog_modules():
+    """
+    imports the cog's pipeline modules without running the package __init__, which needs redbot
+    """
+    if "advancedwelcomes" not in sys.modules:
+        package = types.ModuleType("advancedwelcomes")
+        package.__path__ = [str(COG_DIR)]
+        sys.modules["advancedwelcomes"] = package
+
+    from advancedwelcomes import (
+        assets,
+        avatars,
+        compositing,
+        encoding,
+        rawstore,
+        renderer,
+        templatecache,
+    )
+
+    return types.SimpleNamespace(
+        assets=assets,
+        avatars=avatars,
+        compositing=compositing,
+        encoding=encoding,
+        rawstore=rawstore,
+        renderer=renderer,
+        templatecache=templatecache,
+    )
+
+
+### STUB DISCORD OBJECTS
+class StubAsset:
+    """stands in for discord.Asset, pointing at a file in the local corpus"""
+
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        self.url = str(path)
+
+    def with_static_format(self, fmt):
+        return self
+
+    def with_size(self, size):
+        return self
+
+
+class StubGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class StubMember:
+    def __init__(self, member_id, guild, avatar_path):
+        self.id = member_id
+        self.guild = guild
+        self.mention = f"<@{member_id}>"
+        self.display_avatar = StubAsset(f"bench{member_id}", avatar_path)
+
+
+class _StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return self.data
+
+
+class StubSession:
+    """serves 'downloads' straight from the local corpus, read once up front"""
+
+    def __init__(self, corpus):
+        self._files = {str(path): path.read_bytes() for path in corpus}
+
+    def get(self, url, **kwargs):
+        return _StubResponse(self._files[url])
+
+
+### AVATAR CORPUS
+def build_corpus(directory):
+    """
+    writes a small mix of avatar files: png, jpeg, animated gif and some odd sizes
+    """
+    from PIL import Image, ImageDraw
+
+    specs = [
+        ("square.png", "PNG", (128, 128), "RGBA"),
+        ("large.png", "PNG", (1024, 1024), "RGBA"),
+        ("photo.jpg", "JPEG", (512, 512), "RGB"),
+        ("tall.jpg", "JPEG", (37, 91), "RGB"),
+        ("wide.png", "PNG", (640, 200), "RGB"),
+        ("tiny.png", "PNG", (16, 16), "P"),
+    ]
+    paths = []
+    for index, (name, fmt, size, mode) in enumerate(specs):
+        img = Image.new("RGB", size, (40 * index, 120, 255 - 30 * index))
+        ImageDraw.Draw(img).ellipse(
+            (0, 0, size[0] - 1, size[1] - 1), fill=(255, 200, 0)
+        )
+        path = directory / name
+        img.convert(mode).save(path, format=fmt)
+        paths.append(path)
+
+    frames = [
+        Image.new("RGB", (256, 256), (frame * 20, 80, 160)).convert("P")
+        for frame in range(12)
+    ]
+    path = directory / "animated.gif"
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=80, loop=0)
+    paths.append(path)
+    return paths
+
+
+def load_corpus(directory):
+    suffixes = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+    paths = sorted(p for p in directory.iterdir() if p.suffix.lower() in suffixes)
+    if not paths:
+        raise SystemExit(f"no avatar images found in {directory}")
+    return paths
+
+
+### MEASUREMENT
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarise(samples):
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def render_job(modules, templates, assets, guild_id, path, coords, avatar, encoding):
+    """mirrors AdvancedWelcomes.render_welcome_img, timing the composite and encode separately"""
+    started = time.perf_counter()
+    compiled = templates.compiled(guild_id, "default.png", path, coords, assets)
+    image = compiled.render(avatar)
+    composited = time.perf_counter()
+    encoded = modules.encoding.encode_image(image, encoding)
+    finished = time.perf_counter()
+    return composited - started, finished - composited, encoded.getbuffer().nbytes
+
+
+async def run_level(modules, args, corpus, concurrency):
+    """
+    renders args.joins welcomes with at most concurrency in flight, on fresh caches
+    """
+    assets = modules.assets.AssetRegistry()
+    templates = modules.templatecache.TemplateCache()
+    renderer = modules.renderer.RenderExecutor(
+        workers=args.workers or concurrency, max_queue=concurrency
+    )
+    fetcher = modules.avatars.AvatarFetcher(StubSession(corpus), renderer)
+    encoding = modules.encoding.OutputEncoding(
+        args.format,
+        (
+            args.quality
+            if args.quality is not None
+            else modules.encoding.DEFAULT_QUALITY[args.format]
+        ),
+    )
+
+    guild = StubGuild(1)
+    coords = [args.x, args.y, args.radius]
+    gate = asyncio.Semaphore(concurrency)
+    totals, fetches, composites, encodes, sizes = [], [], [], [], []
+
+    async def join(index):
+        # every join is a new member, so the avatar cache only helps with repeat members
+        member_id = index % args.unique_members if args.unique_members else index
+        member = StubMember(member_id, guild, corpus[index % len(corpus)])
+        async with gate:
+            started = time.perf_counter()
+            avatar = await fetcher.get(member, args.radius)
+            fetched = time.perf_counter()
+            composite, encode, size = await renderer.run(
+                render_job,
+                modules,
+                templates,
+                assets,
+                guild.id,
+                args.template,
+                coords,
+                avatar,
+                encoding,
+            )
+            totals.append(time.perf_counter() - started)
+            fetches.append(fetched - started)
+            composites.append(composite)
+            encodes.append(encode)
+            sizes.append(size)
+
+    # one untimed render so the first sample isn't the template decode
+    await join(-1)
+    totals.clear(), fetches.clear(), composites.clear(), encodes.clear(), sizes.clear()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(join(index) for index in range(args.joins)))
+    elapsed = time.perf_counter() - started
+    renderer.shutdown()
+
+    return {
+        "concurrency": concurrency,
+        "workers": renderer.workers,
+        "joins": args.joins,
+        "wall_s": round(elapsed, 3),
+        "throughput_per_s": round(args.joins / elapsed, 2),
+        "total": summarise(totals),
+        "avatar": summarise(fetches),
+        "composite": summarise(composites),
+        "encode": summarise(encodes),
+        "mean_output_bytes": int(statistics.fmean(sizes)) if sizes else 0,
+        "peak_rss_mb": peak_rss_mb(),
+        "avatar_cache": fetcher.cache.stats(),
+        "template_cache": templates.stats(),
+    }
+
+
+def measure_cold_loads(modules, args, scratch, rounds=20):
+    """
+    times a cold template load and compile, from the png and from its mapped raw copy
+    """
+    assets = modules.assets.AssetRegistry()
+    coords = [args.x, args.y, args.radius]
+    store = modules.rawstore.RawTemplateStore(str(scratch / "raw_templates"))
+    store.load(args.template)
+
+    timings = {}
+    for label, raw_store in (("png", None), ("raw", store)):
+        samples = []
+        for _ in range(rounds):
+            # a new cache every round, like a restart or a rarely used guild
+            templates = modules.templatecache.TemplateCache(raw_store=raw_store)
+            started = time.perf_counter()
+            templates.compiled(1, "default.png", args.template, coords, assets)
+            samples.append(time.perf_counter() - started)
+        timings[label] = summarise(samples)
+    return timings
+
+
+# run in a fresh interpreter, so modules imported by the benchmark itself don't hide the cost
+IMPORT_PROBE = """
+import ast, json, pathlib, sys, time, types, importlib
+# a running bot has already imported these for discord.py
+import asyncio, aiohttp
+cog_dir = pathlib.Path(sys.argv[1])
+package = types.ModuleType("advancedwelcomes")
+package.__path__ = [str(cog_dir)]
+sys.modules["advancedwelcomes"] = package
+tree = ast.parse((cog_dir / "advancedwelcomes.py").read_text())
+names = [node.module for node in tree.body if isinstance(node, ast.ImportFrom) and node.level == 1]
+
+started = time.perf_counter()
+for name in names:
+    importlib.import_module("advancedwelcomes." + name)
+cog_modules = time.perf_counter() - started
+pil_at_load = "PIL" in sys.modules
+
+started = time.perf_counter()
+from advancedwelcomes.assets import AssetRegistry
+AssetRegistry().overlays(325)
+first_image = time.perf_counter() - started
+print(json.dumps({"cog_modules_ms": cog_modules * 1000, "pil_at_load": pil_at_load, "first_image_ms": first_image * 1000}))
+"""
+
+
+def measure_imports():
+    """
+    times importing the modules the cog loads with, which shouldn't pull in PIL,
+    then the first image feature, which does
+    """
+    probe = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE, str(COG_DIR)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(probe.stdout)
+    return {
+        "cog_modules_ms": round(timings["cog_modules_ms"], 1),
+        "pil_at_load": timings["pil_at_load"],
+        "first_image_ms": round(timings["first_image_ms"], 1),
+    }
+
+
+def numpy_one_pass(template, coords, assets):
+    """
+    reference vectorized compositor: blends the avatar and the border into the template region in a single
+    numpy pass over precomputed weights. returns a render(avatar) function, or None without numpy
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    from PIL import Image
+
+    x, y, radius = coords
+    mask, border, border_mask = assets.overlays(radius)
+    avatar_weight = numpy.asarray(mask, dtype=numpy.uint16)[..., None]
+    border_weight = numpy.asarray(border_mask, dtype=numpy.uint16)[..., None]
+    border_weight = numpy.clip(border_weight - avatar_weight, 0, 255)
+
+    region = numpy.asarray(template, dtype=numpy.uint16)[y : y + radius, x : x + radius]
+    border_colour = numpy.asarray(border, dtype=numpy.uint16)
+    # everything that doesn't depend on the avatar, with +127 to round the final /255
+    fixed = (
+        region * (255 - avatar_weight - border_weight)
+        + border_colour * border_weight
+        + 127
+    )
+    base = template.copy()
+    base.paste(Image.fromarray((fixed // 255).astype(numpy.uint8), "RGBA"), (x, y))
+
+    def render(avatar):
+        blended = numpy.asarray(avatar, dtype=numpy.uint16) * avatar_weight
+        blended += fixed
+        blended //= 255
+        out = base.copy()
+        out.paste(Image.fromarray(blended.astype(numpy.uint8), "RGBA"), (x, y))
+        return out
+
+    return render
+
+
+def measure_compositing(modules, args, corpus, rounds=200):
+    """
+    times putting one avatar on the template: the two-paste path, the compiled template's single paste,
+    and the numpy reference when numpy is installed
+    """
+    from PIL import Image
+
+    assets = modules.assets.AssetRegistry()
+    coords = [args.x, args.y, args.radius]
+    with Image.open(args.template) as img:
+        template = img.convert("RGBA")
+    with Image.open(corpus[0]) as img:
+        avatar = img.convert("RGBA").resize((args.radius, args.radius))
+    compiled = modules.compositing.compile_template(template, coords, assets)
+
+    def two_paste():
+        base = template.copy()
+        modules.compositing.paste_avatar(base, avatar, coords, assets)
+
+    paths = {"two_paste": two_paste, "compiled_paste": lambda: compiled.render(avatar)}
+    vectorized = numpy_one_pass(template, coords, assets)
+    if vectorized is not None:
+        paths["numpy_one_pass"] = lambda: vectorized(avatar)
+
+    timings = {}
+    for label, path in paths.items():
+        path()
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            path()
+            samples.append(time.perf_counter() - started)
+        timings[label] = summarise(samples)
+    return timings
+
+
+def compare(results, baseline_path):
+    """
+    prints the change in each percentile against a previous run. returns True if anything regressed
+    """
+    baseline = json.loads(pathlib.Path(baseline_path).read_text())
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    regressed = False
+
+    for level in results["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        for stage in ("total", "encode"):
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                before, after = old[stage][key], level[stage][key]
+                change = (after - before) / before if before else 0.0
+                flag = ""
+                if change > REGRESSION_TOLERANCE:
+                    flag = "  <-- regression"
+                    regressed = True
+                print(
+                    f"c={level['concurrency']:<3} {stage:<7} {key}: "
+                    f"{before:9.2f} -> {after:9.2f} ({change:+.1%}){flag}"
+                )
+    return regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--joins", type=int, default=100, help="renders per level")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="concurrent render levels to measure",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="render threads (default: = concurrency)"
+    )
+    parser.add_argument(
+        "--avatars", type=pathlib.Path, help="folder of avatar images to use as corpus"
+    )
+    parser.add_argument(
+        "--template",
+        type=pathlib.Path,
+        default=COG_DIR / "welcome_template.png",
+        help="template image to render onto",
+    )
+    parser.add_argument("--x", type=int, default=434)
+    parser.add_argument("--y", type=int, default=0)
+    parser.add_argument("--radius", type=int, default=325)
+    parser.add_argument("--format", choices=["png", "webp", "jpeg"], default="png")
+    parser.add_argument("--quality", type=int)
+    parser.add_argument(
+        "--unique-members",
+        type=int,
+        default=0,
+        help="cycle through this many members so avatars repeat (0 = every join is new)",
+    )
+    parser.add_argument("--output", type=pathlib.Path, help="write results json here")
+    parser.add_argument(
+        "--baseline",
+        type=pathlib.Path,
+        help="results json from an earlier run to compare against",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    modules = load_cog_modules()
+    from PIL import __version__ as pillow_version
+
+    with tempfile.TemporaryDirectory() as scratch:
+        corpus = (
+            load_corpus(args.avatars)
+            if args.avatars
+            else build_corpus(pathlib.Path(scratch))
+        )
+        imports = measure_imports()
+        print(
+            f"cog module import: {imports['cog_modules_ms']:.1f} ms "
+            f"(PIL loaded: {imports['pil_at_load']}), "
+            f"first image feature: {imports['first_image_ms']:.1f} ms"
+        )
+        cold = measure_cold_loads(modules, args, pathlib.Path(scratch))
+        print(
+            f"cold template load p50: png {cold['png']['p50_ms']:.1f} ms, "
+            f"raw {cold['raw']['p50_ms']:.1f} ms"
+        )
+        compositing = measure_compositing(modules, args, corpus)
+        print(
+            "composite p50: "
+            + ", ".join(
+                f"{label} {timing['p50_ms']:.2f} ms"
+                for label, timing in compositing.items()
+            )
+        )
+        levels = []
+        for concurrency in args.concurrency:
+            level = asyncio.run(run_level(modules, args, corpus, concurrency))
+            levels.append(level)
+            print(
+                f"c={concurrency:<3} {level['throughput_per_s']:8.1f} renders/s  "
+                f"total p50/p95/p99 {level['total']['p50_ms']:.1f}/"
+                f"{level['total']['p95_ms']:.1f}/{level['total']['p99_ms']:.1f} ms  "
+                f"encode p50 {level['encode']['p50_ms']:.1f} ms  "
+                f"peak rss {level['peak_rss_mb']} MB"
+            )
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": pillow_version,
+        "platform": platform.platform(),
+        "params": {
+            "joins": args.joins,
+            "template": str(args.template),
+            "coords": [args.x, args.y, args.radius],
+            "format": args.format,
+            "quality": args.quality,
+            "corpus": [path.name for path in corpus],
+            "unique_members": args.unique_members,
+        },
+        "imports": imports,
+        "cold_template": cold,
+        "compositing": compositing,
+        "levels": levels,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"results written to {args.output}")
+
+    if args.baseline and compare(results, args.baseline):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import asyncio
+import types
+
+import pytest
+
+pytest.importorskip("redbot")
+
+from advancedwelcomes.advancedwelcomes import AdvancedWelcomes
+from advancedwelcomes.admission import RenderPlan, FULL
+from advancedwelcomes.metrics import WelcomeMetrics
+from advancedwelcomes.settings import GuildSettings
+
+IMAGE_ONLY = {
+    "welcome_msg_channel": 1,
+    "toggle_msg": False,
+    "toggle_img": True,
+    "randomise_msg": False,
+    "randomise_img": False,
+    "def_welcome_msg": "Welcome, {USER}",
+    "mandatory_msg_frag": "read the rules",
+    "message_pool": [],
+    "img_avatar_cfgs": {"default.png": [0, 0]},
+    "img_blobs": {},
+    "burst_window": 0,
+    "burst_threshold": 5,
+    "output_format": "png",
+    "output_quality": 6,
+    "output_max_kb": 0,
+    "send_queue_depth": 20,
+    "send_queue_policy": "collapse",
+    "send_latency_budget": 30,
+    "animated_avatars": False,
+    "render_slo": 5,
+}
+
+
+class RecordingQueue:
+    def __init__(self):
+        self.sent = []
+
+    def reserve(self, channel, limits=None):
+        return types.SimpleNamespace(
+            channel=channel,
+            filled=False,
+            future=asyncio.get_running_loop().create_future(),
+        )
+
+    def fill(self, item, content=None, file=None, fallback=None):
+        item.filled = True
+        self.sent.append((item.channel, content, file))
+
+
+def test_failed_render_in_image_only_guild_still_welcomes_by_text():
+    async def failing_render(*args):
+        raise OSError("template is gone")
+
+    cog = types.SimpleNamespace(
+        metrics=WelcomeMetrics(),
+        outbound=RecordingQueue(),
+        plan_render=lambda settings, trace: RenderPlan(FULL),
+        generate_welcome_img=failing_render,
+    )
+    channel = object()
+    guild = types.SimpleNamespace(
+        id=1, name="test", member_count=10, get_channel=lambda channel_id: channel
+    )
+    member = types.SimpleNamespace(
+        id=2, guild=guild, mention="<@2>", display_name="new member"
+    )
+    settings = GuildSettings.from_config(IMAGE_ONLY)
+
+    async def welcome():
+        item = await AdvancedWelcomes.send_welcome(cog, member, settings)
+        item.future.set_result(None)
+        # lets the trace record once the message is out
+        await asyncio.sleep(0)
+        return item
+
+    assert asyncio.run(welcome()) is not None
+    [(sent_to, content, file)] = cog.outbound.sent
+    assert sent_to is channel
+    assert file is None
+    assert "<@2>" in content
+    assert cog.metrics.guild(guild.id).counters["fallbacks"] == 1